@@ -2,6 +2,7 @@ import numpy as np
 import time
 from minesweeper_env import Minesweeper
 from hexagon_env import HexSweeper
+from board_bank import BoardBank
 
 num_games = 1000
 GUI = False
@@ -9,7 +10,11 @@ move_delay = 0
 rowdim =8
 coldim  = 8
 mine_count = 10
-env = Minesweeper(rowdim, coldim, mine_count, gui=GUI)
+# Directory of a bank made by board_bank.py to play the same games in every
+# run, None generates new games
+board_bank = None
+env = Minesweeper(rowdim, coldim, mine_count, gui=GUI,
+                  board_bank=None if board_bank is None else BoardBank(board_bank))
 
 
 def base_act(state):
@@ -24,10 +29,7 @@ def hex_base_act(state):
         """
         The agent chooses a random action
         """
-        numbers = [hexagon.number for hexagon in state]
-        numbers = np.array(numbers)
-        numbers.shape = (numbers.size//coldim, coldim)
-        flattened_state = numbers.flatten()
+        flattened_state = state.flatten()
         valid_actions = np.where(flattened_state == 7)[0]
         return np.random.choice(valid_actions), valid_actions
 
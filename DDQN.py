@@ -1,7 +1,10 @@
 
+import os
 import numpy as np
-import random
 from SumTree import SumTree
+from ReplayMemory import ReplayMemory
+from encoding import one_hot_encode
+import tensorflow as tf
 from keras import backend as K
 from matplotlib import pyplot as plt
 
@@ -29,6 +32,10 @@ class DoubleDQNAgent:
         self.per_epsilon = kwargs['PER_EPSILON']
         self.lr_piecewise = kwargs['LR_PIECEWISE']
         self.lr_decay_steps = kwargs['LR_DECAY_STEPS']
+        # Optional directory for a memory-mapped, on-disk replay memory
+        self.memory_path = kwargs.get('AGENT_MEMORY_PATH')
+        # Run experience replay as one compiled TensorFlow graph
+        self.compiled_train_step = kwargs.get('COMPILED_TRAIN_STEP', True)
         # Initialize agent parameters
         self.steps = 0
         self.holdout_states = []
@@ -41,113 +48,231 @@ class DoubleDQNAgent:
         # Prioritized Experience Replay (PER) parameters
         self.beta_anneal = (self.per_beta_max - self.per_beta_min) / self.per_beta_anneal_steps
         self.per_beta = self.per_beta_min
-        self.sumtree = SumTree(self.memory_limit)
+        self.memory = ReplayMemory(self.memory_limit, (self.rowdim, self.coldim),
+                                   path=self.memory_path)
+        # Reused buffers for the one-hot encoded minibatch states
+        self.minibatch_nn_states = None
+        self.minibatch_nn_next_states = None
+        self.sumtree = SumTree(self.memory_limit, self.memory)
         self.memory_length = 0
+        self.train_step = None # Built on first use by build_train_step()
+        self.q_function = None # Built on first use by build_q_function()
         
     
-    def act(self, state):
+    def act(self, state, valid_actions=None, nn_state=None):
         """
-        The agent chooses an action
+        The agent chooses an action. valid_actions are the indices of the
+        hidden tiles (#9), e.g. Minesweeper.valid_actions(), if not given
+        they are found from state. nn_state is the one-hot encoded state,
+        e.g. Minesweeper.observation, if not given state is encoded. The
+        returned nn_state is a copy, which the env's next step leaves as is
         """
-        flattened_state = state.flatten()
-        nn_state = self.reshape_state_for_net(state)
+        if nn_state is None:
+            nn_state = self.reshape_state_for_net(state)
+        else:
+            # The env updates its observation in place
+            nn_state = np.copy(nn_state)
+        if valid_actions is None:
+            valid_actions = np.flatnonzero(state == 9)
         # Epsilon-Greedy behavior policy
         if self.epsilon > np.random.rand():
             # Explore, but only choose hidden tiles (#9)
-            valid_actions = np.where(flattened_state == 9)[0]
             return np.random.choice(valid_actions), nn_state, valid_actions
         else:
-            # Exploit, but only choose hidden tiles (#9)
-            valid_actions = [0 if x == 9 else 1 for x in flattened_state]
             # Predict Q-values of actions using re-shaped state
-            q_values = self.online_network.predict(nn_state, verbose=None)
-            # Use valid_actions as a mask to only allow selection of hidden tiles
-            valid_qvalues = np.ma.masked_array(q_values, valid_actions)
+            q_values = self.predict_q(nn_state)
+            # Mask every tile but the valid actions to only allow selection of hidden tiles
+            mask = np.ones(q_values.shape, dtype=bool)
+            mask[..., valid_actions] = False
+            valid_qvalues = np.ma.masked_array(q_values, mask)
             return np.argmax(valid_qvalues), nn_state, np.squeeze(valid_qvalues)
 
 
+    def predict_q(self, nn_state):
+        """
+        Q-values of the online network for a single one-hot encoded state,
+        through a compiled forward pass instead of Keras predict
+        """
+        if self.q_function is None:
+            self.q_function = self.build_q_function()
+        return self.q_function(np.asarray(nn_state, dtype=np.float32)).numpy()
+
+
+    def build_q_function(self):
+        """
+        Compiles the forward pass of the online network for a batch of one
+        state and warms it up, so act does not pay the setup cost of Keras
+        predict on every move. Rebuild it if online_network is replaced
+        """
+        online_network = self.online_network
+        nn_shape = (1, self.rowdim, self.coldim, 9)
+
+        @tf.function(input_signature=[tf.TensorSpec(nn_shape, tf.float32)])
+        def q_function(nn_state):
+            return online_network(nn_state, training=False)
+
+        q_function(tf.zeros(nn_shape)) # Trace and compile once
+        return q_function
+
+
     def experience_replay(self):
         """
         Sampling from past memories
         """
+        minibatch, tree_indices, weights = self._per_sample()
+        if self.compiled_train_step:
+            new_priorities = self._compiled_experience_replay(minibatch, weights)
+        else:
+            new_priorities = self._keras_experience_replay(minibatch, weights)
+        # Update sum tree with new priorities of all sampled experiences at once
+        self.sumtree.update_batch(tree_indices, new_priorities)
+
+
+    def _keras_experience_replay(self, minibatch, weights):
+        """
+        Experience replay through separate Keras predict and train calls
+        """
         # The online network will SELECT the action
         select_network = self.online_network
         # The target network will EVALUATE the action's Q-value
         eval_network = self.target_network
-        
-        minibatch, tree_indices, weights = self._per_sample()
-        minibatch_new_q_values = []
 
-        for experience, tree_idx in zip(minibatch, tree_indices):
-            state, action, reward, next_state, done, nn_state, nn_next_state = experience
-            experience_new_q_values = select_network.predict(nn_state, verbose=None)[0]
-            if done:
-                q_update = reward
-            else:
-                valid_actions = [0 if x == 9 else 1 for x in next_state.flatten()]
-                # Using the select network to SELECT action
-                predicted_qvalues = select_network.predict(nn_next_state, verbose=None)[0]
-                select_net_selected_action = np.argmax(np.ma.masked_array(predicted_qvalues, valid_actions))
-                # Using the eval network to EVALUATE action
-                eval_net_evaluated_q_value = eval_network.predict(nn_next_state)[0][select_net_selected_action]
-                q_update = reward + self.gamma * eval_net_evaluated_q_value
-            # Update sum tree with new priorities of sampled experiences 
-            td_error = experience_new_q_values[action] - q_update
-            td_error = np.clip(td_error, -1, 1) # Clip for stability
-            priority = (np.abs(td_error) + self.per_epsilon)  ** self.per_alpha
-            self.sumtree.update(tree_idx, priority)
-            experience_new_q_values[action] = q_update
-            minibatch_new_q_values.append(experience_new_q_values)
-        minibatch_states = np.squeeze(np.array([e[5] for e in minibatch]))
-        minibatch_new_q_values = np.array(minibatch_new_q_values, dtype=np.float64)
+        states, actions, rewards, next_states, dones, nn_states, nn_next_states = minibatch
+        batch_size = len(actions)
+        batch_idx = np.arange(batch_size)
+        minibatch_states = nn_states.astype(np.float32, copy=False)
+        nn_next_states = nn_next_states.astype(np.float32, copy=False)
+
+        # One forward pass of the select network over states and next states
+        predicted_qvalues = select_network.predict(np.concatenate((minibatch_states, nn_next_states)),
+                                                   batch_size=2*batch_size, verbose=None)
+        minibatch_new_q_values = predicted_qvalues[:batch_size]
+        # Using the select network to SELECT action, only hidden tiles (#9) are valid
+        valid_actions = next_states.reshape(batch_size, -1) == 9
+        select_net_selected_actions = np.argmax(np.where(valid_actions, predicted_qvalues[batch_size:], -np.inf), axis=1)
+        # Using the eval network to EVALUATE action
+        eval_net_evaluated_q_values = eval_network.predict(nn_next_states, batch_size=batch_size,
+                                                           verbose=None)[batch_idx, select_net_selected_actions]
+        q_updates = np.where(dones, rewards, rewards + self.gamma * eval_net_evaluated_q_values)
+        # New priorities of the sampled experiences from their TD errors
+        td_errors = minibatch_new_q_values[batch_idx, actions] - q_updates
+        td_errors = np.clip(td_errors, -1, 1) # Clip for stability
+        new_priorities = (np.abs(td_errors) + self.per_epsilon)  ** self.per_alpha
+        minibatch_new_q_values[batch_idx, actions] = q_updates
         # Apply importance sampling weights during model training
         select_network.train_on_batch(minibatch_states, minibatch_new_q_values, sample_weight=weights)
         # Decay learning rate after training
         K.set_value(select_network.optimizer.learning_rate, self.lrate_decay_callback())
+        return new_priorities
+
+
+    def _compiled_experience_replay(self, minibatch, weights):
+        """
+        Experience replay through the compiled train step
+        """
+        if self.train_step is None:
+            self.train_step = self.build_train_step()
+        states, actions, rewards, next_states, dones, nn_states, nn_next_states = minibatch
+        # Only hidden tiles (#9) are valid actions in the next state
+        valid_actions = next_states.reshape(len(actions), -1) == 9
+        new_priorities = self.train_step(nn_states.astype(np.float32, copy=False), actions.astype(np.int32),
+                                         rewards, dones, nn_next_states.astype(np.float32, copy=False),
+                                         valid_actions, weights.astype(np.float32),
+                                         np.float32(self.lrate_decay_callback()))
+        return new_priorities.numpy()
+
+
+    def build_train_step(self):
+        """
+        Compiles one experience replay step into a single TensorFlow graph:
+        Double DQN target selection and evaluation, importance sampling
+        weighted MSE loss, the optimizer update and the learning rate decay.
+        Returns a function that gives the new priorities of the minibatch
+        """
+        select_network = self.online_network
+        eval_network = self.target_network
+        optimizer = select_network.optimizer
+        num_actions = self.rowdim * self.coldim
+        nn_shape = (None, self.rowdim, self.coldim, 9)
+        gamma = self.gamma
+        per_epsilon = self.per_epsilon
+        per_alpha = self.per_alpha
+
+        @tf.function(input_signature=[
+            tf.TensorSpec(nn_shape, tf.float32), # nn_states
+            tf.TensorSpec((None,), tf.int32), # actions
+            tf.TensorSpec((None,), tf.float32), # rewards
+            tf.TensorSpec((None,), tf.bool), # dones
+            tf.TensorSpec(nn_shape, tf.float32), # nn_next_states
+            tf.TensorSpec((None, num_actions), tf.bool), # valid_actions
+            tf.TensorSpec((None,), tf.float32), # weights
+            tf.TensorSpec((), tf.float32)]) # lrate
+        def train_step(nn_states, actions, rewards, dones, nn_next_states, valid_actions, weights, lrate):
+            # Using the select network to SELECT action
+            next_qvalues = select_network(nn_next_states, training=False)
+            next_qvalues = tf.where(valid_actions, next_qvalues, -np.inf)
+            selected_actions = tf.argmax(next_qvalues, axis=1, output_type=tf.int32)
+            # Using the eval network to EVALUATE action
+            eval_qvalues = eval_network(nn_next_states, training=False)
+            evaluated_qvalues = tf.gather(eval_qvalues, selected_actions, batch_dims=1)
+            q_updates = tf.where(dones, rewards, rewards + gamma * evaluated_qvalues)
+            with tf.GradientTape() as tape:
+                qvalues = select_network(nn_states, training=True)
+                taken_qvalues = tf.gather(qvalues, actions, batch_dims=1)
+                # MSE over all actions as in train_on_batch, the targets only
+                # differ from the predictions at the action taken
+                losses = tf.square(q_updates - taken_qvalues) / num_actions
+                loss = tf.reduce_sum(weights * losses) / tf.cast(tf.shape(losses)[0], tf.float32)
+            gradients = tape.gradient(loss, select_network.trainable_variables)
+            optimizer.apply_gradients(zip(gradients, select_network.trainable_variables))
+            # Decay learning rate after training
+            optimizer.learning_rate.assign(lrate)
+            # New priorities of the sampled experiences from their TD errors
+            td_errors = taken_qvalues - q_updates
+            td_errors = tf.clip_by_value(td_errors, -1, 1) # Clip for stability
+            return (tf.abs(td_errors) + per_epsilon) ** per_alpha
+
+        return train_step
 
 
     def _per_sample(self):
         """
         Sampling from memory
         """
-        minibatch = []
-        tree_indices = []
-        priorities = []
-        weights = []
-
-        # Proportionally sample agent's memory        
+        # Proportionally sample agent's memory, one sample per segment
         samples_per_segment = self.sumtree.total() / self.batch_size
-        for segment in range(0,self.batch_size):
-            seg_start = samples_per_segment * segment
-            seg_end = samples_per_segment * (segment + 1)
-            sample = random.uniform(seg_start, seg_end)
-            (tree_index, priority, experience) = self.sumtree.get(sample)
-            tree_indices.append(tree_index)
-            priorities.append(priority)
-            minibatch.append(experience)
-        
-        # Calculate and scale weights for importance sampling
-        min_probability = np.min(priorities) / self.sumtree.total()
-        max_weight = (min_probability * self.memory_length) ** (-self.per_beta)
-        for priority in priorities:
-            probability = priority / self.sumtree.total()
-            weight = (probability * self.memory_length) ** (-self.per_beta)
-            weights.append(weight / max_weight)
-            
-        return minibatch, tree_indices, np.array(weights)
+        seg_starts = samples_per_segment * np.arange(0,self.batch_size)
+        samples = np.random.uniform(seg_starts, seg_starts + samples_per_segment)
+        (tree_indices, priorities, minibatch) = self.sumtree.sample_batch(samples)
+        # Memory only holds boards, encode the sampled states for the networks
+        states, actions, rewards, next_states, dones = minibatch
+        if self.minibatch_nn_states is None or len(self.minibatch_nn_states) != len(states):
+            nn_shape = states.shape + (9,)
+            self.minibatch_nn_states = np.empty(nn_shape, dtype=np.float32)
+            self.minibatch_nn_next_states = np.empty(nn_shape, dtype=np.float32)
+        nn_states = one_hot_encode(states, 9, out=self.minibatch_nn_states)
+        nn_next_states = one_hot_encode(next_states, 9, out=self.minibatch_nn_next_states)
+        minibatch = (states, actions, rewards, next_states, dones, nn_states, nn_next_states)
+
+        # Importance sampling weights (priority / total * memory_length) ** -beta
+        # scaled by the largest weight in memory, i.e. the weight of the
+        # smallest priority in the sum tree. Total and memory_length cancel out
+        weights = (priorities / self.sumtree.min()) ** (-self.per_beta)
+
+        return minibatch, tree_indices, weights
     
 
     def remember(self, state, action, reward, next_state, done, nn_state):
-        # Memory includes the one-hot encoded versions of the state and next
-        # state to eliminate redundant computation
-        nn_next_state = self.reshape_state_for_net(next_state)
+        # Memory only holds the boards, they are one-hot encoded when sampled.
+        # state and next_state are the boards before and after the move, the
+        # env returns copies so they stay unchanged
         priority = 1
-        experience = (state, action, reward, next_state, done, nn_state, nn_next_state)
+        experience = (state, action, reward, next_state, done)
         self.sumtree.add(priority, experience)
         if self.memory_length < self.memory_limit: self.memory_length += 1
         # Make copies of the initial states as a holdout set
         if len(self.holdout_states) < self.num_holdout_states:
-            self.holdout_states.append(nn_state)
+            self.holdout_states.append(np.copy(nn_state))
 
     
     def reshape_state_for_net(self, state):
@@ -157,11 +282,9 @@ class DoubleDQNAgent:
         """
         # Making prediction on rowdim by coldim input
         batch_size = 1
-        nn_input = np.zeros((batch_size,self.rowdim, self.coldim, 9))
+        boards = np.reshape(state, (batch_size, self.rowdim, self.coldim))
         # Perform one-hot encoding on Minesweeper grid
-        for tile_num in range(0,9):
-            idx1, idx2 = np.where(state == tile_num)
-            nn_input[0, idx1, idx2, tile_num] = 1
+        nn_input = one_hot_encode(boards, 9)
         
         return nn_input
     
@@ -174,6 +297,43 @@ class DoubleDQNAgent:
         print("Saved models to disk")
 
 
+    def save_memory_to_disk(self, filename):
+        """
+        Saves the replay memory, its priorities, write pointer and length to
+        an uncompressed .npz file. The file is written next to the target
+        and then renamed, so a crash mid-save keeps the previous snapshot
+        """
+        arrays = {'tree' : self.sumtree.tree,
+                  'min_tree' : self.sumtree.min_tree,
+                  'write' : np.array([self.sumtree.write]),
+                  'memory_length' : np.array([self.memory_length])}
+        for name in self.memory.fields + ('size',):
+            arrays[name] = getattr(self.memory, name)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(tmp_filename, filename)
+        print("Saved replay memory to disk")
+
+
+    def load_memory_from_disk(self, filename):
+        """
+        Restores a replay memory saved with save_memory_to_disk into the
+        agent's preallocated memory
+        """
+        with np.load(filename, allow_pickle=False) as snapshot:
+            if snapshot['tree'].shape != self.sumtree.tree.shape:
+                raise ValueError('Replay memory snapshot holds {} experiences, agent memory holds {}'
+                                 .format((snapshot['tree'].size+1)//2, self.memory_limit))
+            self.sumtree.tree[:] = snapshot['tree']
+            self.sumtree.min_tree[:] = snapshot['min_tree']
+            self.sumtree.write = int(snapshot['write'][0])
+            self.memory_length = int(snapshot['memory_length'][0])
+            for name in self.memory.fields + ('size',):
+                getattr(self.memory, name)[...] = snapshot[name]
+        print("Loaded replay memory from disk")
+
+
     def lrate_decay_callback(self):
         # Decays NN learning rate in a piecewise-linear fashion during training
         lr_ds = self.lr_decay_steps
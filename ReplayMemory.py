@@ -0,0 +1,67 @@
+import os
+import numpy as np
+
+
+class ReplayMemory:
+    """
+    Columnar storage for experiences. Behaves like an array of experience
+    tuples (state, action, reward, next_state, done) so it can be used as
+    SumTree.data, but keeps every field in its own preallocated, compactly
+    typed array. Only the boards are stored, the agents one-hot encode a
+    minibatch when it is sampled.
+
+    If a path is given the fields are kept in memory-mapped .npy files in
+    that directory instead of RAM, so the capacity is limited by disk space.
+    Such a memory can be reopened by other processes with mode='r'
+    """
+
+    fields = ('states', 'actions', 'rewards', 'next_states', 'dones')
+
+    def __init__(self, capacity, board_shape, path=None, mode='w+'):
+        self.capacity = capacity
+        self.board_shape = tuple(board_shape)
+        self.path = path
+        # int16 covers every board up to 181x181, larger boards need int32
+        action_dtype = np.int16 if np.prod(self.board_shape) <= np.iinfo(np.int16).max else np.int32
+        layout = {
+            'states' : ((capacity,) + self.board_shape, np.int8),
+            'actions' : ((capacity,), action_dtype),
+            'rewards' : ((capacity,), np.float32),
+            'next_states' : ((capacity,) + self.board_shape, np.int8),
+            'dones' : ((capacity,), bool),
+            'size' : ((1,), np.int64), # Number of slots written so far
+            }
+        if path is not None and mode == 'w+':
+            os.makedirs(path, exist_ok=True)
+        for name, (shape, dtype) in layout.items():
+            if path is None:
+                column = np.zeros(shape, dtype=dtype)
+            else:
+                # Shape and dtype are read from the file header unless creating
+                column = np.lib.format.open_memmap(os.path.join(path, name + '.npy'),
+                                                   mode=mode, dtype=dtype, shape=shape)
+            setattr(self, name, column)
+
+    def __len__(self):
+        return self.capacity
+
+    def __setitem__(self, idx, experience):
+        state, action, reward, next_state, done = experience
+        self.states[idx] = np.reshape(state, self.board_shape)
+        self.actions[idx] = action
+        self.rewards[idx] = reward
+        self.next_states[idx] = np.reshape(next_state, self.board_shape)
+        self.dones[idx] = done
+        if idx >= self.size[0]:
+            self.size[0] = idx + 1
+
+    def __getitem__(self, idx):
+        # A single index returns one experience, an index array returns a
+        # batch with one array per field
+        return tuple(getattr(self, name)[idx] for name in self.fields)
+
+    def flush(self):
+        # Write pending changes of a memory-mapped memory to disk
+        if self.path is not None:
+            for name in self.fields + ('size',):
+                getattr(self, name).flush()
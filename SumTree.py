@@ -3,34 +3,47 @@ import numpy
 class SumTree:
     write = 0
 
-    def __init__(self, capacity):
+    def __init__(self, capacity, data=None):
         self.capacity = capacity
         self.tree = numpy.zeros( 2*capacity - 1 )
-        self.data = numpy.zeros( capacity, dtype=object )
+        # Parallel tree holding the minimum priority of each subtree, empty
+        # slots are infinite so they never count as the minimum
+        self.min_tree = numpy.full( 2*capacity - 1, numpy.inf )
+        # data can be any indexable store, e.g. a typed ReplayMemory
+        if data is None:
+            data = numpy.zeros( capacity, dtype=object )
+        self.data = data
 
     def _propagate(self, idx, change):
-        parent = (idx - 1) // 2
+        while idx != 0:
+            idx = (idx - 1) // 2
+            self.tree[idx] += change
 
-        self.tree[parent] += change
-
-        if parent != 0:
-            self._propagate(parent, change)
+    def _propagate_min(self, idx):
+        while idx != 0:
+            idx = (idx - 1) // 2
+            self.min_tree[idx] = min(self.min_tree[2*idx + 1], self.min_tree[2*idx + 2])
 
     def _retrieve(self, idx, s):
-        left = 2 * idx + 1
-        right = left + 1
+        while True:
+            left = 2 * idx + 1
+            right = left + 1
 
-        if left >= len(self.tree):
-            return idx
+            if left >= len(self.tree):
+                return idx
 
-        if s <= self.tree[left]:
-            return self._retrieve(left, s)
-        else:
-            return self._retrieve(right, s-self.tree[left])
+            if s <= self.tree[left]:
+                idx = left
+            else:
+                s -= self.tree[left]
+                idx = right
 
     def total(self):
         return self.tree[0]
 
+    def min(self):
+        return self.min_tree[0]
+
     def add(self, p, data):
         idx = self.write + self.capacity - 1
 
@@ -46,9 +59,42 @@ class SumTree:
 
         self.tree[idx] = p
         self._propagate(idx, change)
+        self.min_tree[idx] = p
+        self._propagate_min(idx)
+
+    def update_batch(self, indices, priorities):
+        # Write all leaves at once, then recompute their ancestors one level
+        # per iteration. Parents are summed from their children rather than
+        # incremented, so repeated indices behave like sequential updates
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        self.tree[indices] = priorities
+        self.min_tree[indices] = priorities
+        parents = numpy.unique((indices[indices > 0] - 1) // 2)
+        while parents.size > 0:
+            self.tree[parents] = self.tree[2*parents + 1] + self.tree[2*parents + 2]
+            self.min_tree[parents] = numpy.minimum(self.min_tree[2*parents + 1], self.min_tree[2*parents + 2])
+            parents = numpy.unique((parents[parents > 0] - 1) // 2)
 
     def get(self, s):
         idx = self._retrieve(0, s)
         dataIdx = idx - self.capacity + 1
 
         return (idx, self.tree[idx], self.data[dataIdx])
+
+    def sample_batch(self, values):
+        # Descend the tree for every value simultaneously, one level per
+        # iteration, and return the same fields as get() as arrays
+        s = numpy.array(values, dtype=numpy.float64)
+        idx = numpy.zeros(s.shape, dtype=numpy.int64)
+        while True:
+            left = 2 * idx + 1
+            internal = left < len(self.tree)
+            if not internal.any():
+                break
+            left_sum = self.tree[numpy.where(internal, left, 0)]
+            go_right = internal & (s > left_sum)
+            s = numpy.where(go_right, s - left_sum, s)
+            idx = numpy.where(internal, left + go_right, idx)
+        dataIdx = idx - self.capacity + 1
+
+        return (idx, self.tree[idx], self.data[dataIdx])
@@ -0,0 +1,262 @@
+"""
+Benchmarks for the performance critical parts of the agents and environments.
+
+Run all benchmarks with `python benchmark.py` or a selection by name, e.g.
+`python benchmark.py train_step`
+"""
+import sys
+import time
+import numpy as np
+from minesweeper_env import Minesweeper, BitboardMinesweeper
+
+
+def time_per_call(func, repeats, warmup=1):
+    # Average wall-clock time of func() in seconds, after warmup calls
+    for _ in range(warmup):
+        func()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - start) / repeats
+
+
+def create_dqn(rowdim, coldim, channels):
+    # Same network as in train_minesweeper
+    from keras.models import Sequential
+    from keras.layers import Conv2D, Flatten, Input
+    from keras.optimizers import Adam
+    model = Sequential()
+    model.add(Input(shape=(rowdim, coldim, channels)))
+    for _ in range(6):
+        model.add(Conv2D(64, (3, 3), padding='same', activation='relu', use_bias=True))
+    model.add(Conv2D(1, (1, 1), padding='same', activation='linear', use_bias=True))
+    model.add(Flatten())
+    model.compile(loss='mse', optimizer=Adam(learning_rate=0.001))
+    return model
+
+
+def create_agent(rowdim, coldim, batch_size, memory_limit):
+    from DDQN import DoubleDQNAgent
+    agent_kwargs = {
+        'ROWDIM' : rowdim,
+        'COLDIM' : coldim,
+        'LR_PIECEWISE' : [0.001, 0.0005],
+        'LR_DECAY_STEPS' : [0, 1e6],
+        'GAMMA' : 0.99,
+        'EPSILON_INITIAL' : 1,
+        'EPSILON_DECAY' : 0.99,
+        'EPSILON_MIN' : 0,
+        'TAU' : 1,
+        'EXPERIENCE_REPLAY_BATCH_SIZE' : batch_size,
+        'AGENT_MEMORY_LIMIT' : memory_limit,
+        'NUM_HOLDOUT_STATES' : 0,
+        'PER_ALPHA' : 0.6,
+        'PER_BETA_MIN' : 0.4,
+        'PER_BETA_MAX' : 1.0,
+        'PER_BETA_ANNEAL_STEPS' : 1e6,
+        'PER_EPSILON' : 0.01,
+        }
+    return DoubleDQNAgent(create_dqn(rowdim, coldim, 9), create_dqn(rowdim, coldim, 9), **agent_kwargs)
+
+
+def fill_memory(agent, env, num_steps):
+    # Fills the agent's replay memory with random play
+    state = env.reset()
+    for _ in range(num_steps):
+        action = np.random.choice(np.where(state.flatten() == 9)[0])
+        nn_state = agent.reshape_state_for_net(state)
+        next_state, reward, done = env.step(action)
+        agent.remember(state, action, reward, next_state, done, nn_state)
+        state = env.reset() if done else next_state
+
+
+def benchmark_train_step(rowdim=8, coldim=8, mine_count=10, batch_size=1024, repeats=10):
+    # Latency of one experience replay step through Keras predict and
+    # train_on_batch calls versus the compiled train step
+    agent = create_agent(rowdim, coldim, batch_size, 4*batch_size)
+    fill_memory(agent, Minesweeper(rowdim, coldim, mine_count), 4*batch_size)
+    print('Experience replay step, {}x{} board, batch size {}'.format(rowdim, coldim, batch_size))
+    for compiled in (False, True):
+        agent.compiled_train_step = compiled
+        seconds = time_per_call(agent.experience_replay, repeats)
+        print('  {:<10} {:8.1f} ms/step'.format('compiled' if compiled else 'keras', seconds*1e3))
+
+
+def benchmark_act(rowdim=8, coldim=8, mine_count=10, repeats=500, target_ms=2.0):
+    # Per-move latency of the greedy policy through Keras predict versus the
+    # compiled single-state forward pass used by act
+    agent = create_agent(rowdim, coldim, 1, 1)
+    agent.epsilon = 0
+    state = Minesweeper(rowdim, coldim, mine_count).reset()
+    nn_state = agent.reshape_state_for_net(state)
+    print('Greedy action selection, {}x{} board'.format(rowdim, coldim))
+    seconds = time_per_call(lambda: agent.online_network.predict(nn_state, verbose=0), repeats)
+    print('  {:<10} {:8.3f} ms/move'.format('predict', seconds*1e3))
+    seconds = time_per_call(lambda: agent.predict_q(nn_state), repeats)
+    print('  {:<10} {:8.3f} ms/move'.format('compiled', seconds*1e3))
+    seconds = time_per_call(lambda: agent.act(state), repeats)
+    print('  {:<10} {:8.3f} ms/move (target {} ms)'.format('act', seconds*1e3, target_ms))
+
+
+def benchmark_generate_field(repeats=2000):
+    # Time to generate one minefield for the classic board sizes
+    print('Minefield generation')
+    for rowdim, coldim, mine_count in ((8, 8, 10), (16, 16, 40), (16, 30, 99)):
+        env = Minesweeper(rowdim, coldim, mine_count)
+        seconds = time_per_call(env.generate_field, repeats)
+        print('  {:>2}x{:<2} {:>2} mines {:8.1f} us/field'.format(rowdim, coldim, mine_count, seconds*1e6))
+
+
+def benchmark_auto_reveal(repeats=200):
+    # Cost of the largest zero cascade on large, sparse boards. Labeling the
+    # zero regions is part of generate_field and timed with it
+    print('Zero cascade on sparse boards')
+    for size, mine_count in ((32, 20), (64, 80), (100, 200)):
+        env = Minesweeper(size, size, mine_count)
+        env.reset()
+        region_sizes = np.diff(env.region_bounds)
+        action = np.flatnonzero(env.zero_labels == np.argmax(region_sizes))[0]
+        env.playerfield[:] = 9
+        reveal_seconds = time_per_call(lambda: env.auto_reveal_tiles(action), repeats)
+        generate_seconds = time_per_call(env.generate_field, repeats)
+        print('  {:>3}x{:<3} {:>3} mines, {:>5} tiles revealed {:8.1f} us/cascade {:8.1f} us/field'
+              .format(size, size, mine_count, region_sizes.max(), reveal_seconds*1e6, generate_seconds*1e6))
+
+
+def play_random_games(env, num_tiles, is_hidden, num_steps):
+    # Plays random hidden tiles for num_steps steps, resetting finished
+    # games. Each game tries the tiles in a random order, so choosing an
+    # action does not scan the board
+    steps = 0
+    while steps < num_steps:
+        env.reset()
+        for action in np.random.permutation(num_tiles):
+            if is_hidden(env, action):
+                _, _, done = env.step(action)
+                steps += 1
+                if done or steps == num_steps:
+                    break
+
+
+def benchmark_env_backends():
+    # Steps per second of random play, resets included, for the NumPy and
+    # the compiled (jit=True) backends of both environments
+    from hexagon_env import HexSweeper
+    import env_kernels
+    print('Environment steps, random play{}'.format('' if env_kernels.NUMBA_AVAILABLE else
+                                                  ' (Numba not installed, jit falls back)'))
+    square_hidden = lambda env, action: env.playerfield.flat[action] == 9
+    hex_hidden = lambda env, action: env.player_grid.flat[action] == 7
+    cases = (
+        ('Minesweeper 8x8', lambda jit: Minesweeper(8, 8, 10, jit=jit), 64, square_hidden, 20000),
+        ('Minesweeper 16x16', lambda jit: Minesweeper(16, 16, 40, jit=jit), 256, square_hidden, 20000),
+        ('HexSweeper 8x8', lambda jit: HexSweeper(8, 8, 10, jit=jit), 64, hex_hidden, 2000),
+        ('HexSweeper 16x16', lambda jit: HexSweeper(16, 16, 40, jit=jit), 256, hex_hidden, 500),
+        )
+    for name, create_env, num_tiles, is_hidden, num_steps in cases:
+        for jit in (False, True):
+            env = create_env(jit)
+            seconds = time_per_call(lambda: play_random_games(env, num_tiles, is_hidden, num_steps), 1)
+            print('  {:<18} {:<6} {:10.0f} steps/s'.format(name, 'jit' if env.jit else 'numpy', num_steps/seconds))
+
+
+def benchmark_bitboard(num_steps=50000):
+    # Steps per second of random play on the 8x8 training board for the
+    # array, compiled and bitboard versions of Minesweeper
+    print('Environment steps, random play, 8x8 10 mines')
+    is_hidden = lambda env, action: env.playerfield.flat[action] == 9
+    for name, env in (('numpy', Minesweeper(8, 8, 10)), ('jit', Minesweeper(8, 8, 10, jit=True)),
+                      ('bitboard', BitboardMinesweeper(8, 8, 10))):
+        seconds = time_per_call(lambda: play_random_games(env, 64, is_hidden, num_steps), 1)
+        print('  {:<10} {:10.0f} steps/s'.format(name, num_steps/seconds))
+
+
+def time_safe_moves(env, num_steps, valid_actions):
+    # Average time of a random move on a non-mine tile, chosen among
+    # valid_actions(env), and its step. Resets are not timed
+    seconds = 0
+    steps = 0
+    while steps < num_steps:
+        env.reset()
+        start = time.perf_counter()
+        while not env.done and steps < num_steps:
+            hidden = valid_actions(env)
+            action = hidden[np.random.randint(len(hidden))]
+            while env.minefield.flat[action] == -1:
+                action = hidden[np.random.randint(len(hidden))]
+            env.step(action)
+            steps += 1
+        seconds += time.perf_counter() - start
+    return seconds / num_steps
+
+
+def benchmark_board_scaling(num_steps=500):
+    # Cost of a move from 8x8 to 256x256 boards at the mine density of 8x8
+    # with 10 mines, finding the hidden tiles by scanning the board versus
+    # the tiles tracked by the env with track_frontier
+    print('Move and reset cost by board size')
+    scan = lambda env: np.flatnonzero(env.playerfield == 9)
+    tracked = lambda env: env.valid_actions()
+    for size in (8, 16, 32, 64, 128, 256):
+        mine_count = size * size * 10 // 64
+        plain_env = Minesweeper(size, size, mine_count)
+        tracking_env = Minesweeper(size, size, mine_count, track_frontier=True)
+        print('  {:>3}x{:<3} scan {:8.1f} us/move {:8.2f} ms/reset, tracked {:8.1f} us/move {:8.2f} ms/reset'.format(
+            size, size, time_safe_moves(plain_env, num_steps, scan)*1e6, time_per_call(plain_env.reset, 5)*1e3,
+            time_safe_moves(tracking_env, num_steps, tracked)*1e6, time_per_call(tracking_env.reset, 5)*1e3))
+
+
+def benchmark_hex_neighbors(repeats=200):
+    # Neighbor lookups for hex board generation: geometric search through
+    # the HexagonTile objects for every mine versus the neighbor table,
+    # which is built once per board shape
+    from hexagon_env import HexSweeper, init_hexagons
+    import env_kernels
+    print('Hex board generation')
+    for size, mine_count in ((16, 40), (32, 160)):
+        hexagons = init_hexagons(size, size)
+        mines = np.random.choice(size*size, mine_count, replace=False)
+        geometry_seconds = time_per_call(lambda: [hexagons[i].compute_neighbours(hexagons) for i in mines], 3)
+        table_seconds = time_per_call(lambda: env_kernels.hex_neighbors.__wrapped__(size, size), repeats)
+        env = HexSweeper(size, size, mine_count)
+        generate_seconds = time_per_call(env.generate_field, repeats)
+        print('  {:>2}x{:<2} {:>3} mines, geometric lookups {:8.2f} ms/field, table {:8.1f} us/shape, '
+              'generate_field {:8.1f} us/field'.format(size, size, mine_count, geometry_seconds*1e3,
+                                                      table_seconds*1e6, generate_seconds*1e6))
+
+
+def benchmark_hex_reset(num_resets=100000):
+    # Cost of HexSweeper.reset and the memory it leaves allocated over many
+    # episodes, which should stay at zero as the board storage is reused
+    import tracemalloc
+    from hexagon_env import HexSweeper
+    print('HexSweeper reset')
+    for size, mine_count in ((8, 10), (16, 40), (32, 160)):
+        env = HexSweeper(size, size, mine_count, one_hot=True)
+        seconds = time_per_call(env.reset, num_resets)
+        tracemalloc.start()
+        start_size, _ = tracemalloc.get_traced_memory()
+        for _ in range(num_resets):
+            env.reset()
+        end_size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('  {:>2}x{:<2} {:8.2f} us/reset, {:>6} bytes kept after {} resets'
+              .format(size, size, seconds*1e6, end_size - start_size, num_resets))
+
+
+BENCHMARKS = {
+    'train_step' : benchmark_train_step,
+    'act' : benchmark_act,
+    'generate_field' : benchmark_generate_field,
+    'auto_reveal' : benchmark_auto_reveal,
+    'env_backends' : benchmark_env_backends,
+    'bitboard' : benchmark_bitboard,
+    'board_scaling' : benchmark_board_scaling,
+    'hex_neighbors' : benchmark_hex_neighbors,
+    'hex_reset' : benchmark_hex_reset,
+    }
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,87 @@
+"""
+Pre-generated Minesweeper games for fast, reproducible resets.
+
+A board bank holds seeded games with their opening move already played:
+the minefield, the player's view after the opening and the score of the
+opening. Minesweeper(..., board_bank=bank) resets by taking the next game
+of the bank instead of generating one, so evaluation runs of different
+agents play exactly the same boards.
+
+Create a bank with e.g.
+`python board_bank.py banks/8x8 1000000 8 8 10 --seed 0`
+"""
+import os
+import argparse
+import numpy as np
+from minesweeper_env import VectorMinesweeper
+
+
+class BoardBank:
+    """
+    Games stored as .npy files in the directory path, one file per field,
+    and memory-mapped so banks larger than RAM can be used. mode='r' opens
+    an existing bank, mode='w+' creates one for num_boards boards of shape
+    board_shape
+    """
+
+    fields = ('minefields', 'playerfields', 'scores')
+
+    def __init__(self, path, mode='r', num_boards=None, board_shape=None):
+        self.path = path
+        layout = {
+            'minefields' : (None if num_boards is None else (num_boards,) + tuple(board_shape), np.int8),
+            'playerfields' : (None if num_boards is None else (num_boards,) + tuple(board_shape), np.int8),
+            'scores' : (None if num_boards is None else (num_boards,), np.int32),
+            'mine_count' : ((1,), np.int64),
+            }
+        if mode == 'w+':
+            os.makedirs(path, exist_ok=True)
+        for name, (shape, dtype) in layout.items():
+            # Shape and dtype are read from the file header unless creating
+            column = np.lib.format.open_memmap(os.path.join(path, name + '.npy'),
+                                               mode=mode, dtype=dtype, shape=shape)
+            setattr(self, name, column)
+        self.board_shape = self.minefields.shape[1:]
+
+    def __len__(self):
+        return len(self.minefields)
+
+    def __getitem__(self, idx):
+        # The minefield, player's view and score of game idx
+        return tuple(getattr(self, name)[idx] for name in self.fields)
+
+    def flush(self):
+        for name in self.fields + ('mine_count',):
+            getattr(self, name).flush()
+
+
+def generate_board_bank(path, num_boards, rowdim, coldim, mine_count, seed=0, batch_size=10000):
+    """
+    Generates num_boards games with VectorMinesweeper, seeded with seed, and
+    writes them to a new bank in path. The same arguments always give the
+    same bank
+    """
+    bank = BoardBank(path, 'w+', num_boards, (rowdim, coldim))
+    bank.mine_count[0] = mine_count
+    env = VectorMinesweeper(min(batch_size, num_boards), rowdim, coldim, mine_count)
+    env.seed(seed)
+    for start in range(0, num_boards, env.num_envs):
+        env.reset()
+        stop = min(start + env.num_envs, num_boards)
+        bank.minefields[start:stop] = env.minefield[:stop-start]
+        bank.playerfields[start:stop] = env.playerfield[:stop-start]
+        bank.scores[start:stop] = env.score[:stop-start]
+    bank.flush()
+    return bank
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-generate a bank of Minesweeper games')
+    parser.add_argument('path', help='directory to write the bank to')
+    parser.add_argument('num_boards', type=int)
+    parser.add_argument('rowdim', type=int)
+    parser.add_argument('coldim', type=int)
+    parser.add_argument('mine_count', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_board_bank(args.path, args.num_boards, args.rowdim, args.coldim, args.mine_count, args.seed)
@@ -0,0 +1,30 @@
+import numpy as np
+
+
+# Lookup tables mapping a tile number, viewed as uint8, to its one-hot row
+_one_hot_tables = {}
+
+
+def one_hot_encode(boards, channels, out=None, dtype=np.float32):
+    """
+    One-hot encodes boards of shape (N, rows, cols) into an array of shape
+    (N, rows, cols, channels) with a single table lookup. Tile number k sets
+    channel k, hidden tiles, mines and numbers >= channels are all zeros.
+    If out is given the encoding is written into it and its dtype is used
+    """
+    boards = np.asarray(boards)
+    if out is not None:
+        dtype = out.dtype
+    key = (channels, np.dtype(dtype))
+    table = _one_hot_tables.get(key)
+    if table is None:
+        table = np.zeros((256, channels), dtype=dtype)
+        table[:channels] = np.eye(channels, dtype=dtype)
+        _one_hot_tables[key] = table
+    # Negative tile numbers wrap around to rows >= channels, which are zero
+    if boards.dtype.itemsize == 1:
+        indices = boards.view(np.uint8)
+    else:
+        indices = boards.astype(np.uint8)
+    # Indices are always within the table, mode='clip' avoids buffering out
+    return np.take(table, indices, axis=0, out=out, mode='clip')
@@ -0,0 +1,99 @@
+"""
+Compiled kernels for the Minesweeper and HexSweeper environments, used when
+an environment is created with jit=True.
+
+Boards are flat integer arrays indexed like the actions of the environments.
+The board geometry is given as a neighbor table: row i holds the flat
+indices of the neighbors of tile i, padded with -1 where a neighbor would
+lie off the board. The tables are built once per board shape and shared
+between environments, so they are read-only. The kernels are compiled with
+Numba when it is installed, otherwise NUMBA_AVAILABLE is False and the
+environments keep their NumPy implementation
+"""
+import functools
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        # Leaves the functions as plain Python
+        return lambda func: func
+
+
+@functools.lru_cache(maxsize=None)
+def square_neighbors(rowdim, coldim):
+    # Neighbor table of a rowdim x coldim square grid, 8 neighbors per tile
+    rows, cols = np.divmod(np.arange(rowdim*coldim), coldim)
+    offsets = [(i, j) for i in range(-1,2) for j in range(-1,2) if (i, j) != (0, 0)]
+    neighbors = np.full((rowdim*coldim, len(offsets)), -1, dtype=np.int64)
+    for n, (i, j) in enumerate(offsets):
+        valid = (rows + i >= 0) & (rows + i < rowdim) & (cols + j >= 0) & (cols + j < coldim)
+        neighbors[valid, n] = ((rows + i) * coldim + cols + j)[valid]
+    neighbors.flags.writeable = False
+    return neighbors
+
+
+@functools.lru_cache(maxsize=None)
+def hex_neighbors(width, height):
+    # Neighbor table of the hexagonal board of init_hexagons, 6 neighbors
+    # per tile. Tile i lies in row i // width, odd rows are shifted half a
+    # tile to the left, so the rows above and below hold the neighbors at
+    # columns c and c+1 for even rows and c-1 and c for odd rows
+    rows, cols = np.divmod(np.arange(width*height), width)
+    shift = rows % 2
+    offsets = [(0, -1), (0, 1), (-1, -shift), (-1, 1 - shift), (1, -shift), (1, 1 - shift)]
+    neighbors = np.full((width*height, len(offsets)), -1, dtype=np.int64)
+    for n, (i, j) in enumerate(offsets):
+        valid = (rows + i >= 0) & (rows + i < height) & (cols + j >= 0) & (cols + j < width)
+        neighbors[valid, n] = ((rows + i) * width + cols + j)[valid]
+    neighbors.flags.writeable = False
+    return neighbors
+
+
+@njit(cache=True)
+def place_mines(minefield, neighbors, candidates, draws, mine_count):
+    # Places mine_count mines on distinct tiles drawn from candidates by a
+    # partial Fisher-Yates shuffle, with draws uniform in [0, 1), and sets
+    # every other tile to the number of adjacent mines. The environments
+    # check that mine_count is at most the number of candidates
+    candidates = candidates.copy()
+    minefield[:] = 0
+    for i in range(mine_count):
+        j = i + int(draws[i] * (candidates.size - i))
+        tile = candidates[j]
+        candidates[j] = candidates[i]
+        candidates[i] = tile
+        minefield[tile] = -1
+    for i in range(mine_count):
+        for neighbor in neighbors[candidates[i]]:
+            if neighbor >= 0 and minefield[neighbor] != -1:
+                minefield[neighbor] += 1
+
+
+@njit(cache=True)
+def reveal(minefield, playerfield, neighbors, action, hidden, queue):
+    # Reveals the tile action and, if it is a zero, the connected zero tiles
+    # and their borders by a breadth-first search. playerfield shows hidden
+    # for hidden tiles, queue is a buffer of one entry per tile. Returns the
+    # number of tiles newly revealed, their indices are queue[:count]
+    count = 0
+    if playerfield[action] == hidden:
+        playerfield[action] = minefield[action]
+        queue[0] = action
+        count = 1
+    head = 0
+    while head < count:
+        tile = queue[head]
+        head += 1
+        if minefield[tile] != 0:
+            continue
+        for neighbor in neighbors[tile]:
+            if neighbor >= 0 and playerfield[neighbor] == hidden:
+                playerfield[neighbor] = minefield[neighbor]
+                queue[count] = neighbor
+                count += 1
+    return count
@@ -1,10 +1,10 @@
 
 from hexagontile import HexagonTile
-import copy
+import warnings
 import numpy as np
 import random
-from collections import deque
 import pygame
+import env_kernels
 
 def hide_tiles(hexagons):
         for hexagon in hexagons:
@@ -22,32 +22,12 @@ def create_hexagon(position, radius=12, number=0) -> HexagonTile:
 
 def init_hexagons(num_x, num_y, flat_top=False):
     """Creates a hexaogonal tile map of size num_x * num_y"""
-    leftmost_hexagon = create_hexagon(position=(50, 0))
-    hexagons = [leftmost_hexagon]
-    for x in range(num_y):
-        if x:
-            # alternate between bottom left and bottom right vertices of hexagon above
-            index = 2 if x % 2 == 1 else 4
-            position = leftmost_hexagon.vertices[index]
-            leftmost_hexagon = create_hexagon(position)
-            hexagons.append(leftmost_hexagon)
-
-        # place hexagons to the left of leftmost hexagon, with equal y-values.
-        hexagon = leftmost_hexagon
-        for i in range(num_x - 1):
-            x, y = hexagon.position  # type: ignore
-            if flat_top:
-                pass
-            else:
-                position = (x + hexagon.minimal_radius * 2, y)
-            hexagon = create_hexagon(position, )
-            hexagons.append(hexagon)
-
-    return hexagons
+    # Only pointy top hexagons are supported, flat_top is ignored
+    return HexagonTile.create_board(num_x, num_y, radius=12, origin=(50, 0))
 
 class HexSweeper:
 
-    def __init__(self, width, height, mine_count, gui=False) -> None:
+    def __init__(self, width, height, mine_count, gui=False, jit=False, one_hot=False) -> None:
         self.width = width
         self.height = height
         self.mine_count = mine_count
@@ -55,10 +35,33 @@ class HexSweeper:
         self.num_moves = 0
         self.done = False
         self.explosion = False
-        self.grid = np.zeros([height, width])
-        self.player_grid = np.ones([height, width]) * 7
-        self.board = init_hexagons(width, height)
-        self.visible_board = hide_tiles(copy.deepcopy(self.board))
+        self.np_random = np.random.RandomState() # For seeding the environment
+        # The board is kept as arrays indexed like the actions, row by row.
+        # grid holds the numbers and mines (-1), player_grid the numbers the
+        # player sees with 7 for hidden tiles. HexagonTile objects are only
+        # created for the GUI
+        self.grid = np.zeros([height, width], dtype=int)
+        self.player_grid = np.ones([height, width], dtype=int) * 7
+        self.num_hidden_tiles = width * height
+        # Neighbors of every tile, shared by all boards of this shape
+        self.neighbors = env_kernels.hex_neighbors(width, height)
+        # The same as lists without the off-board entries, for the flood fill
+        self.neighbor_lists = [[n for n in row if n >= 0] for row in self.neighbors.tolist()]
+        self.mine_candidates = np.setdiff1d(np.arange(width*height), self.safe_tiles())
+        if mine_count > self.mine_candidates.size:
+            raise ValueError('{} mines do not fit on the {} tiles of a {}x{} board outside the first move'
+                             .format(mine_count, self.mine_candidates.size, width, height))
+        # With jit the board is updated by the compiled kernels of env_kernels
+        if jit and not env_kernels.NUMBA_AVAILABLE:
+            warnings.warn('Numba is not installed, HexSweeper falls back to NumPy')
+            jit = False
+        self.jit = jit
+        # With one_hot the env keeps the one-hot encoded numbers of the
+        # visible board of shape (1, height, width, 7) in observation, as the
+        # agent's network input. Only the tiles a step reveals are updated
+        self.observation = np.zeros((1, height, width, 7), dtype=np.float32) if one_hot else None
+        if jit:
+            self.reveal_queue = np.zeros(width*height, dtype=np.int64)
         if gui:
             self.init_gui() # if gui = True, initialize GUI
     
@@ -66,38 +69,35 @@ class HexSweeper:
         """
         gets action as input and returns the next state, the reward and if the game is over
         when the action is implemented,
+        the board is updated in place and the state is a copy of player_grid
         """
         # generates minefield if it is the start of the game
-        if self.num_moves == 0: self.generate_field(action, self.board)
-
-        numbers = [hexagon.number for hexagon in self.visible_board]
-        numbers = np.array(numbers)
-
-        naw = [hexagon.number for hexagon in self.board]
-        naw = np.array(naw)
-
-
-        numbers[action] = naw[action].copy() # sets the tile chosen in the minefield state to the playerfield state
-        for i in range(len(numbers)):
-            self.visible_board[i].number = numbers[i]
+        if self.num_moves == 0: self.generate_field()
+        if self.jit:
+            return self.jit_step(action)
 
-        num_hidden_tiles = np.count_nonzero(numbers == 7)
-        if numbers[action] == -1:
+        tile = self.grid.flat[action]
+        was_hidden = self.player_grid.flat[action] == 7
+        if was_hidden:
+            # sets the tile chosen in the minefield state to the playerfield state
+            self.player_grid.flat[action] = tile
+            self.num_hidden_tiles -= 1
+            self.note_revealed(np.array([action]))
+        if tile == -1:
             # Tile was a mine, game over
             done = True
             self.explosion = True
             reward = -1
             score = 0 
-        elif num_hidden_tiles == self.mine_count:
+        elif self.num_hidden_tiles == self.mine_count:
             # Game won when all safe tiles revealed
             done = True
             reward = 1.0
             score = 1
-        elif numbers[action] == 0:
-            # IF tile = 0, reveal tiles recursively
-            state, score = self.auto_reveal_tiles(action, self.visible_board)
-            num_hidden_tiles = np.count_nonzero(state == 7)
-            if num_hidden_tiles == self.mine_count:
+        elif tile == 0 and was_hidden:
+            # IF tile = 0, reveal tiles recursively, scoring every revealed tile
+            score = 1 + self.auto_reveal_tiles(action)
+            if self.num_hidden_tiles == self.mine_count:
                 # Game won
                 done = True
                 reward = 1.0
@@ -108,18 +108,58 @@ class HexSweeper:
             # Revealed a safe tile, but has not won yet
             done = False
             reward = 0.1
-            score = 1
-        # Update parameters + reshape
-        
-        for i in range(len(self.visible_board)):
-            self.visible_board[i].number = numbers[i]
+            score = 0 if tile == 0 else 1
+        self.score += score
+        self.done = done
+        self.num_moves += 1
+        return self.player_grid.copy(), reward, done
 
 
-        #self.visible_board = state
+    def jit_step(self, action):
+        """
+        step() through the compiled reveal kernel, which reveals the tile
+        and its zero cascade at once
+        """
+        tile = self.grid.flat[action]
+        revealed = env_kernels.reveal(self.grid.ravel(), self.player_grid.ravel(),
+                                      self.neighbors, action, 7, self.reveal_queue)
+        self.note_revealed(self.reveal_queue[:revealed])
+        self.num_hidden_tiles -= revealed
+        if tile == -1:
+            done = True
+            self.explosion = True
+            reward = -1
+            score = 0
+        else:
+            done = self.num_hidden_tiles == self.mine_count
+            reward = 1.0 if done else 0.1
+            # A zero scores every tile of its cascade. A won board scores at
+            # least 1, also when a move on it reveals nothing
+            score = revealed if tile == 0 else 1
+            if done:
+                score = max(score, 1)
         self.score += score
         self.done = done
         self.num_moves += 1
-        return self.visible_board, reward, done
+        return self.player_grid.copy(), reward, done
+
+    def note_revealed(self, tiles):
+        """
+        Sets the numbers of the newly revealed tiles in the observation
+        """
+        if self.observation is not None:
+            numbers = self.grid.flat[tiles]
+            shown = numbers >= 0
+            self.observation.flat[tiles[shown]*7 + numbers[shown]] = 1
+
+    def seed(self, seed=None):
+        self.np_random.seed(seed)
+
+    def safe_tiles(self):
+        """
+        Index of the tiles of safe moves, the 3x3 block in the top left corner
+        """
+        return [0, 1, 2, self.width, self.width + 1, self.width + 2, 2*self.width, 2*self.width + 1, 2*self.width + 2]
        
     
     def play_first_move(self):
@@ -128,7 +168,7 @@ class HexSweeper:
         """
 
         # List for all the safe tiles in top left corner 3x3 grid
-        safe_lst = [0, 1, 2, self.width, self.width + 1, self.width + 2, 2*self.width, 2*self.width + 1, 2*self.width + 2]
+        safe_lst = self.safe_tiles()
         for i in safe_lst:
             state, reward, done = self.step(i)
         return state
@@ -142,73 +182,67 @@ class HexSweeper:
         self.num_moves = 0
         self.explosion = False
         self.done = False
-        self.board = init_hexagons(self.width, self.height)
-        self.visible_board = hide_tiles(copy.deepcopy(self.board))
+        # The board storage is reused, only the numbers are cleared. grid is
+        # overwritten when the field is generated on the first move
+        self.player_grid.fill(7)
+        self.num_hidden_tiles = self.width * self.height
+        if self.observation is not None:
+            self.observation.fill(0)
         #state = self.play_first_move()
-        state = self.visible_board
+        state = self.player_grid.copy()
         return state
 
-    def generate_field(self, action, hexagons):
+    def generate_field(self):
         """
         Generates minefield using seed
         """ 
+        if self.jit:
+            draws = self.np_random.random_sample(self.mine_count)
+            env_kernels.place_mines(self.grid.ravel(), self.neighbors,
+                                    self.mine_candidates, draws, self.mine_count)
+            return
 
-        # Index of the tiles of safe moves
-        safe_lst = [0, 1, 2, self.width, self.width + 1, self.width + 2, 2*self.width, 2*self.width + 1, 2*self.width + 2]
-        num_mines = 0
-        while num_mines < self.mine_count:
-            # Pick random tile
-            tile = random.choice(hexagons)
-            # Check if tile is not first move
-            if not any(tile == hexagons[a] for a in safe_lst):
-                if tile.number != -1:
-                    tile.number = -1
-                    num_mines += 1
+        # Mines are placed on distinct tiles outside the safe first moves
+        mines = self.np_random.choice(self.mine_candidates, self.mine_count, replace=False)
+        # Count neighbor mines, every mine adds one to each of its neighbors
+        neighbors = self.neighbors[mines].ravel()
+        self.grid.flat[:] = np.bincount(neighbors[neighbors >= 0], minlength=self.grid.size)
+        self.grid.flat[mines] = -1
 
-            # Count neighbor mines
-                for hexagon in tile.compute_neighbours(hexagons):
-                     if hexagon.number != -1:
-                        hexagon.number += 1
-
-    def auto_reveal_tiles(self, action, hexagons):
+    def auto_reveal_tiles(self, action):
         """
         IF tile is revealed with value = 0, then all neighbors of that mine
-        wil be revealed. Does this recursively
+        wil be revealed. Does this recursively. Returns the number of tiles
+        revealed besides action
         """
-        i = 0
-        # Index of chosen tile
-
-        tile = hexagons[action]
-        old_zeros = [] # Keep track of already revealed zeros
-        new_zeros = deque([tile]) # Keep track of newly discovered zeros
-        state = self.visible_board.copy()
-        revealed_tiles = []
-        for hexagon in state:
-            if hexagon.number != 7:
-                revealed_tiles.append(hexagon)
-        score = 0
-        zero_found = True
-        while zero_found:
-            for hexagon in tile.compute_neighbours(state):
-                if hexagon.position >= (0,0) and hexagon not in revealed_tiles:
-                    self.visible_board[i].number = hexagon.number
-                    score += 1
-                    revealed_tiles.append(hexagon)
-                    if hexagon.number == 0:
-                        if hexagon not in old_zeros:
-                            if hexagon not in new_zeros:
-                                new_zeros.append(hexagon)
-                i += 1
-            old_zeros.append(new_zeros.popleft())
-            if len(new_zeros) == 0:
-                zero_found = False
-
-        return self.visible_board, score
+        # Breadth-first search from action through the zeros. Tiles are marked
+        # in the visited bitmap when queued, so every tile of the cascade is
+        # visited once and the search is linear in the size of the cascade.
+        # The bitmaps are bytes, which index much faster than arrays
+        visited = bytearray((self.player_grid != 7).tobytes())
+        zeros = (self.grid == 0).tobytes()
+        queue = [action]
+        revealed = []
+        for tile in queue:
+            for neighbor in self.neighbor_lists[tile]:
+                if not visited[neighbor]:
+                    visited[neighbor] = 1
+                    revealed.append(neighbor)
+                    if zeros[neighbor]:
+                        queue.append(neighbor)
+        # Reveal the zeros and their border at once
+        revealed = np.array(revealed, dtype=np.int64)
+        self.player_grid.flat[revealed] = self.grid.flat[revealed]
+        self.num_hidden_tiles -= len(revealed)
+        self.note_revealed(revealed)
+        return len(revealed)
     
     def init_gui(self):
         # Initialize all PyGame and GUI parameters
         pygame.init()
         #pygame.mixer.quit() # Fixes bug with high PyGame CPU usage
+        # Tiles to draw the board with, their numbers are set from player_grid
+        self.hexagons = hide_tiles(init_hexagons(self.width, self.height))
         self.tile_rowdim = 32 # pixels per tile along the horizontal
         self.tile_coldim = 32 # pixels per tile along the vertical
         self.ui_height = 32 # Contains text regarding score and move #
@@ -230,8 +264,9 @@ class HexSweeper:
         """
         Plots minefield (current state) shown to player 
         """
-        for hexagon in self.visible_board:
+        for hexagon, number in zip(self.hexagons, self.player_grid.flat):
         #hexagon = pygame.transform.scale(hexagon, (1280, 720))
+            hexagon.number = int(number)
             hexagon.render(self.gameDisplay)
             label = self.tilefont.render(str(hexagon.number), 1, (0,0,0))
             self.gameDisplay.blit(label, hexagon.centre)
@@ -4,22 +4,56 @@ import random
 from typing import List
 from typing import Tuple
 
+# Ratio of the minimal to the maximal radius of a hexagon
+COS_30 = math.cos(math.radians(30))
+
 def get_random_colour(min_=150, max_=255) -> Tuple[int, ...]:
-    return tuple(random.choices(list(range(min_, max_)), k=3))
+    return tuple(random.choices(range(min_, max_), k=3))
+
+def get_random_colours(count, min_=150, max_=255) -> List[Tuple[int, ...]]:
+    """count colours of get_random_colour, drawn with a single call"""
+    components = random.choices(range(min_, max_), k=3*count)
+    return list(zip(components[0::3], components[1::3], components[2::3]))
 
 class HexagonTile:
+    # A board holds one tile per action, so tiles keep their attributes in
+    # slots and compute their geometry once, as tiles do not move
+    __slots__ = ('radius', 'number', 'position', 'colour', 'minimal_radius', 'centre', 'vertices',
+                 'max_highlight_ticks', 'highlight_tick', 'highlight_offset')
     
-    def __init__(self, position, radius, number):
+    def __init__(self, position, radius, number, colour=None):
         self.radius = radius
         self.number = number
         #self.radius = 50
         self.position = position
-        self.colour = get_random_colour()
+        self.colour = get_random_colour() if colour is None else colour
+        # Horizontal length of the hexagon
+        self.minimal_radius = radius * COS_30
+        # Centre of the hexagon
+        self.centre = (position[0], position[1] + radius)
         self.vertices = self.compute_vertices()
         self.max_highlight_ticks = 15
         self.highlight_tick = 0
         self.highlight_offset = 3
 
+    @classmethod
+    def create_board(cls, num_x, num_y, radius=12, number=0, origin=(50, 0)) -> List['HexagonTile']:
+        """Returns the tiles of a board of num_y rows of num_x tiles, row by row.
+        Every row lies half a tile to the left or right of the row above,
+        so that the tiles of the rows interlock. Positions are computed
+        directly instead of from the vertices of the neighbouring tiles
+        """
+        minimal_radius = radius * COS_30
+        colours = iter(get_random_colours(num_x * num_y))
+        tiles = []
+        for row in range(num_y):
+            # Odd rows are shifted half a tile to the left
+            x = origin[0] - (row % 2) * minimal_radius
+            y = origin[1] + row * 1.5 * radius
+            tiles.extend(cls((x + 2 * col * minimal_radius, y), radius, number, next(colours))
+                         for col in range(num_x))
+        return tiles
+
 
     
     def compute_vertices(self) -> List[Tuple[float, float]]:
@@ -66,13 +100,8 @@ class HexagonTile:
         pygame.draw.polygon(screen, self.highlight_colour, self.vertices)
 
     @property
-    def centre(self) -> Tuple[float, float]:
-        """Centre of the hexagon"""
-        x, y = self.position 
-        return (x, y + self.radius)
-
-    @property
-    def minimal_radius(self) -> float:
-        """Horizontal length of the hexagon"""
-        return self.radius * math.cos(math.radians(30))
+    def highlight_colour(self) -> Tuple[int, ...]:
+        """Colour of the hexagon, brightened while it is highlighted"""
+        offset = self.highlight_offset * self.highlight_tick
+        return tuple(min(component + offset, 255) for component in self.colour)
     
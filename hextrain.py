@@ -8,6 +8,7 @@ from keras.layers import Flatten
 from keras.optimizers import Adam
 from matplotlib import pyplot as plt
 import numpy as np
+import os
 from datetime import datetime
 from hexagon_env import HexSweeper
 from DDQN_hexagon import DoubleDQNAgent
@@ -70,7 +71,8 @@ ENV_NAME = 'Minesweeper'
 ROWDIM = 8 # Number of rows in the Minesweeper grid
 COLDIM = 8 # Number of columns in the Minesweeper grid
 MINE_COUNT = 10
-env = HexSweeper(ROWDIM, COLDIM, MINE_COUNT)
+# The env keeps the one-hot encoded board for the agent, see act()
+env = HexSweeper(ROWDIM, COLDIM, MINE_COUNT, one_hot=True)
 #env.seed(1)
 
 
@@ -86,6 +88,7 @@ TAU = 1 # Target network soft update, set to 1 to copy online network
 EXPERIENCE_REPLAY_BATCH_SIZE = 1024
 AGENT_MEMORY_LIMIT = EXPERIENCE_REPLAY_BATCH_SIZE*100
 NUM_HOLDOUT_STATES = EXPERIENCE_REPLAY_BATCH_SIZE
+AGENT_MEMORY_PATH = None # Directory for a memory-mapped replay memory, None keeps it in RAM
 # Prioritized Experience Replay (PER) parameters
 PER_ALPHA = 0.6 # Exponent that determines how much prioritization is used
 PER_BETA_MIN = 0.4 # Starting value of importance sampling correction
@@ -107,6 +110,7 @@ agent_kwargs = {
     'EXPERIENCE_REPLAY_BATCH_SIZE' : EXPERIENCE_REPLAY_BATCH_SIZE,
     'AGENT_MEMORY_LIMIT' : AGENT_MEMORY_LIMIT,
     'NUM_HOLDOUT_STATES' : NUM_HOLDOUT_STATES,
+    'AGENT_MEMORY_PATH' : AGENT_MEMORY_PATH,
     'PER_ALPHA' : PER_ALPHA,
     'PER_BETA_MIN' : PER_BETA_MIN,
     'PER_BETA_MAX' : PER_BETA_MAX,
@@ -126,6 +130,8 @@ TRAIN_NETWORK_STEPS = EXPERIENCE_REPLAY_BATCH_SIZE/2 # Interval in steps before
 MIN_MEMORY_FOR_EXPERIENCE_REPLAY = 2*EXPERIENCE_REPLAY_BATCH_SIZE
 UPDATE_TARGET_STEPS = 80 * TRAIN_NETWORK_STEPS # Number of steps before updating target network
 HOLDOUT_EPOCH = 200*TRAIN_NETWORK_STEPS # Number of agent steps between holdout state evaluations
+MEMORY_SNAPSHOT_FILE = None # .npz file to periodically save the replay memory to and resume from
+MEMORY_SNAPSHOT_EPISODES = 500 # Number of episodes between replay memory snapshots
 
 
 # %% Training Loop
@@ -134,6 +140,8 @@ for trial_index in range(NUMBER_OF_TRIALS):
     target_network = create_dqn(LR_PIECEWISE[0])
     # Uncomment lines below to resume training on an existing model
     agent = DoubleDQNAgent(online_network, target_network, **agent_kwargs)
+    if MEMORY_SNAPSHOT_FILE is not None and os.path.exists(MEMORY_SNAPSHOT_FILE):
+        agent.load_memory_from_disk(MEMORY_SNAPSHOT_FILE)
     trial_episode_scores = []
     holdout_states_q = []
     avg_holdout_q = 0
@@ -141,7 +149,7 @@ for trial_index in range(NUMBER_OF_TRIALS):
     for episode_index in range(1, MAX_TRAINING_EPISODES+1):
         state = env.reset()
         for step_num in range(0, MAX_STEPS_PER_EPISODE):
-            action, nn_state, _ = agent.act(state)
+            action, nn_state, _ = agent.act(state, nn_state=env.observation)
             next_state, reward, done = env.step(action)
             agent.remember(state, action, reward, next_state, done, nn_state)
             state = next_state
@@ -172,6 +180,8 @@ for trial_index in range(NUMBER_OF_TRIALS):
         print('T %d E %d scored %d (%s), avg %.2f, avg q %.2f, epsilon %.3f, lr %.3E' \
               % (trial_index,episode_index, episode_score, result, moving_avg,\
                  avg_holdout_q, agent.epsilon, agent.lrate))
+        if MEMORY_SNAPSHOT_FILE is not None and episode_index % MEMORY_SNAPSHOT_EPISODES == 0:
+            agent.save_memory_to_disk(MEMORY_SNAPSHOT_FILE)
         if len(trial_episode_scores) >= MOVING_AVE_WINDOW and moving_avg >= SOLVE_CONDITION: 
             print('Trial %d solved in %d episodes!' % (trial_index, episode_index))
             agent.save_model_to_disk(ENV_NAME, str(episode_index), create_timestamp())
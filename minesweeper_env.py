@@ -19,24 +19,230 @@ Created on Sun May  5 19:02:40 2019
 """
 
 
+import warnings
 import pygame
 import numpy as np
-from collections import deque
+import env_kernels
+from encoding import one_hot_encode
+
+
+def dilate(masks):
+    # Grows boolean masks of shape (N, rows, cols) by one tile in all 8
+    # directions, i.e. a mask of every tile and its neighbors
+    # Separable: first along the rows, then along the columns
+    rows = masks.copy()
+    rows[:, 1:, :] |= masks[:, :-1, :]
+    rows[:, :-1, :] |= masks[:, 1:, :]
+    dilated = rows.copy()
+    dilated[:, :, 1:] |= rows[:, :, :-1]
+    dilated[:, :, :-1] |= rows[:, :, 1:]
+    return dilated
+
+
+def count_neighbor_mines(mines):
+    # Number of mines among the 8 neighbors of every tile, for boolean mine
+    # masks of shape (N, rows, cols), as a separable 3x3 sum
+    mines = mines.astype(np.int8)
+    rows = mines.copy()
+    rows[:, 1:, :] += mines[:, :-1, :]
+    rows[:, :-1, :] += mines[:, 1:, :]
+    counts = rows.copy()
+    counts[:, :, 1:] += rows[:, :, :-1]
+    counts[:, :, :-1] += rows[:, :, 1:]
+    counts -= mines
+    return counts
+
+
+def zero_regions(minefield):
+    # Labels the 8-connected regions of zero tiles of a (rows, cols)
+    # minefield. Returns the region of every tile (-1 for non-zero tiles)
+    # and the flat indices of each region's tiles plus the tiles bordering
+    # it, as tiles[bounds[region]:bounds[region+1]]
+    rowdim, coldim = minefield.shape
+    size = rowdim * coldim
+    zeros = minefield == 0
+    # Every zero tile starts labeled with its own flat index, the labels then
+    # converge to the smallest index in the region. Non-zero tiles hold size
+    labels = np.where(zeros, np.arange(size).reshape(rowdim, coldim), size)
+    lookup = np.full(size + 1, size)
+    while True:
+        # Smallest label in the 3x3 neighborhood, first along rows then columns
+        rows = labels.copy()
+        np.minimum(rows[1:], labels[:-1], out=rows[1:])
+        np.minimum(rows[:-1], labels[1:], out=rows[:-1])
+        grown = rows.copy()
+        np.minimum(grown[:, 1:], rows[:, :-1], out=grown[:, 1:])
+        np.minimum(grown[:, :-1], rows[:, 1:], out=grown[:, :-1])
+        grown[~zeros] = size
+        # Pointer jumping: take over the label of the tile a label refers to
+        lookup[:size] = grown.ravel()
+        grown = lookup[grown]
+        if np.array_equal(grown, labels):
+            break
+        labels = grown
+    zero_tiles = np.flatnonzero(zeros)
+    roots, regions = np.unique(labels.ravel()[zero_tiles], return_inverse=True)
+    region_labels = np.full(size, -1)
+    region_labels[zero_tiles] = regions
+    # Pair every tile with the regions among its 3x3 neighborhood, keyed as
+    # region * size + tile so that sorting groups the tiles by region
+    region_labels = region_labels.reshape(rowdim, coldim)
+    neighbor_regions = np.full((9, rowdim, coldim), -1)
+    for n, (k, h) in enumerate((k, h) for k in range(-1,2) for h in range(-1,2)):
+        neighbor_regions[n, max(k,0):rowdim+min(k,0), max(h,0):coldim+min(h,0)] = \
+            region_labels[max(-k,0):rowdim-max(k,0), max(-h,0):coldim-max(h,0)]
+    keys = neighbor_regions * size + np.arange(size).reshape(rowdim, coldim)
+    keys = np.unique(keys[neighbor_regions >= 0])
+    tiles = keys % size
+    bounds = np.searchsorted(keys // size, np.arange(len(roots) + 1))
+    return region_labels, tiles, bounds
+
+
+def opening_actions(rowdim, coldim):
+    # Flat indices of the tiles played by Minesweeper.play_first_move, in
+    # order: tile (1,1) and then every tile of its 3x3 block
+    opening = [(1,1)] + [(1+i, 1+j) for i in range(-1,2) for j in range(-1,2)]
+    return [np.ravel_multi_index(tile, (rowdim, coldim)) for tile in opening
+            if tile[0] < rowdim and tile[1] < coldim]
+
+
+def generate_minefields(num_boards, rowdim, coldim, mine_count, np_random, reserved=()):
+    # Generates num_boards minefields of shape (num_boards, rowdim, coldim)
+    # with mines as -1 and other tiles the number of adjacent mines. Mine
+    # positions are drawn uniformly without replacement from all tiles
+    # except the flat indices in reserved
+    allowed = np.ones(rowdim*coldim, dtype=bool)
+    allowed[list(reserved)] = False
+    candidates = np.flatnonzero(allowed)
+    if mine_count > candidates.size:
+        raise ValueError('{} mines do not fit on the {} tiles of a {}x{} board outside the opening'
+                         .format(mine_count, candidates.size, rowdim, coldim))
+    keys = np_random.random_sample((num_boards, candidates.size))
+    # The mine_count tiles with the smallest random keys receive a mine
+    if mine_count < candidates.size:
+        chosen = candidates[np.argpartition(keys, mine_count, axis=1)[:, :mine_count]]
+    else:
+        chosen = np.broadcast_to(candidates, keys.shape)
+    mines = np.zeros((num_boards, rowdim*coldim), dtype=bool)
+    mines[np.arange(num_boards)[:, None], chosen] = True
+    mines = mines.reshape(num_boards, rowdim, coldim)
+    minefield = count_neighbor_mines(mines)
+    minefield[mines] = -1
+    return minefield
+
+
+class TileSet:
+    """
+    Set of flat tile indices of a board with membership, insertion and
+    removal in time proportional to the tiles added or removed. The members
+    are the first len(set) entries of tiles, in no particular order, so
+    they are available without scanning the board
+    """
+
+    def __init__(self, size, members=()):
+        self.tiles = np.zeros(size, dtype=np.int64)
+        self.position = np.full(size, -1) # Index of each tile in tiles, -1 if absent
+        self.count = 0
+        self.add(np.asarray(members, dtype=np.int64))
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, tile):
+        return self.position[tile] >= 0
+
+    def members(self):
+        return self.tiles[:self.count]
+
+    def add(self, tiles):
+        # Appends the tiles that are not members yet
+        tiles = np.unique(tiles[self.position[tiles] < 0])
+        self.tiles[self.count:self.count+tiles.size] = tiles
+        self.position[tiles] = np.arange(self.count, self.count + tiles.size)
+        self.count += tiles.size
+
+    def add_tile(self, tile):
+        if self.position[tile] < 0:
+            self.tiles[self.count] = tile
+            self.position[tile] = self.count
+            self.count += 1
+
+    def remove_tile(self, tile):
+        # The last member takes the place of the removed tile
+        position = self.position[tile]
+        if position >= 0:
+            self.count -= 1
+            last = self.tiles[self.count]
+            self.tiles[position] = last
+            self.position[last] = position
+            self.position[tile] = -1
+
+    def remove(self, tiles):
+        # Removes the tiles that are members, the holes they leave among the
+        # first count entries are filled with the members after them
+        tiles = np.unique(tiles[self.position[tiles] >= 0])
+        count = self.count - tiles.size
+        holes = self.position[tiles]
+        holes = holes[holes < count]
+        self.position[tiles] = -1
+        tail = self.tiles[count:self.count]
+        movers = tail[self.position[tail] >= 0]
+        self.tiles[holes] = movers
+        self.position[movers] = holes
+        self.count = count
+
 
 
 class Minesweeper:
 
-    def __init__(self, rowdim, coldim, mine_count, gui=False):
+    def __init__(self, rowdim, coldim, mine_count, gui=False, jit=False, board_bank=None,
+                 track_frontier=False, one_hot=False):
         self.rowdim = rowdim # number of tiles along the row dimension
         self.coldim = coldim # number of tiles along the column dimension
         self.mine_count = mine_count
-        self.minefield = np.zeros((rowdim,coldim), dtype='int') # The complete game state
-        self.playerfield = np.ones((rowdim,coldim), dtype='int')*9 # The state the player sees
+        self.minefield = np.zeros((rowdim,coldim), dtype=np.int8) # The complete game state
+        self.playerfield = np.full((rowdim,coldim), 9, dtype=np.int8) # The state the player sees
+        self.num_hidden_tiles = rowdim * coldim # Tiles of playerfield still showing 9
         self.explosion = False # True if player selects mine
         self.done = False # Game complete (win or loss)
         self.score = 0
         self.np_random = np.random.RandomState() # For seeding the environment
         self.move_num = 0 # Track number of player moves per game
+        self.opening_actions = opening_actions(rowdim, coldim) # Tiles of the first move
+        self.zero_labels = None # Zero regions of the minefield, see generate_field
+        # Distinct tiles of the first move and the step that first plays each
+        self.opening_tiles, self.opening_first_steps = np.unique(self.opening_actions, return_index=True)
+        if mine_count > rowdim*coldim - self.opening_tiles.size:
+            raise ValueError('{} mines do not fit on the {} tiles of a {}x{} board outside the opening'
+                             .format(mine_count, rowdim*coldim - self.opening_tiles.size, rowdim, coldim))
+        # With jit the board is generated and revealed by the compiled
+        # kernels of env_kernels, which need Numba
+        if jit and not env_kernels.NUMBA_AVAILABLE:
+            warnings.warn('Numba is not installed, Minesweeper falls back to NumPy')
+            jit = False
+        self.jit = jit
+        # With track_frontier the hidden tiles and the frontier, the hidden
+        # tiles next to a revealed tile, are kept as TileSets updated with
+        # the tiles each step reveals, see valid_actions and frontier_actions
+        self.track_frontier = track_frontier
+        self.hidden = None
+        self.frontier = None
+        # With one_hot the env keeps the one-hot encoded playerfield of shape
+        # (1, rowdim, coldim, 9) in observation, as the agent's network input.
+        # Only the channels of the tiles a step reveals are set
+        self.observation = np.zeros((1, rowdim, coldim, 9), dtype=np.float32) if one_hot else None
+        if jit or track_frontier:
+            self.neighbors = env_kernels.square_neighbors(rowdim, coldim)
+        if jit:
+            self.mine_candidates = np.setdiff1d(np.arange(rowdim*coldim), self.opening_actions)
+            self.reveal_queue = np.zeros(rowdim*coldim, dtype=np.int64)
+        # With a BoardBank, reset continues with the next game of the bank
+        if board_bank is not None and (board_bank.board_shape != (rowdim, coldim) or
+                                       board_bank.mine_count[0] != mine_count):
+            raise ValueError('Board bank holds {}x{} boards with {} mines'.format(
+                *board_bank.board_shape, board_bank.mine_count[0]))
+        self.board_bank = board_bank
+        self.bank_index = 0 # Next game of the bank
         if gui:
             self.init_gui() # Pygame related parameters
 
@@ -44,26 +250,34 @@ class Minesweeper:
     def step(self, action):
         # Function accepts the player's action as an input and returns the new
         # environment state, a reward, and whether the episode has terminated
-        state = self.playerfield.flatten()
-        minefield_state = self.minefield.flatten()
-        state[action] = minefield_state[action]
-        num_hidden_tiles = np.count_nonzero(state == 9)
-        if state[action] == -1:
+        # The board is updated in place and the returned state is a copy of
+        # it, so callers can keep the states of earlier moves. The number of
+        # hidden tiles is kept up to date, so revealing a non-zero tile does
+        # not depend on the board size
+        if self.jit:
+            return self.jit_step(action)
+        row, col = divmod(int(action), self.coldim)
+        tile = self.minefield[row, col]
+        was_hidden = bool(self.playerfield[row, col] == 9)
+        self.playerfield[row, col] = tile
+        self.num_hidden_tiles -= was_hidden
+        if was_hidden:
+            self.note_revealed_tile(action)
+        if tile == -1:
             # Tile was a hidden mine, game over
             done = True
             self.explosion = True
             reward = -1
             score = 0 # Hitting mine should not subtract points from score
-        elif num_hidden_tiles == self.mine_count:
+        elif self.num_hidden_tiles == self.mine_count:
             # The player has won by revealing all non-mine tiles
             done = True
             reward = 1.0
             score = 1
-        elif state[action] == 0:
+        elif tile == 0:
             # The tile was a zero, run auto-reveal routine
-            state, score = self.auto_reveal_tiles(action)
-            num_hidden_tiles = np.count_nonzero(state == 9)
-            if num_hidden_tiles == self.mine_count:
+            score = was_hidden + self.auto_reveal_tiles(action)
+            if self.num_hidden_tiles == self.mine_count:
                 done = True
                 reward = 1.0
             else:
@@ -75,12 +289,96 @@ class Minesweeper:
             reward = 0.1
             score = 1
         # Update environment parameters
-        state = state.reshape(self.rowdim, self.coldim)
-        self.playerfield = state
-        self.score += score 
+        self.score += int(score)
         self.done = done
         self.move_num += 1
-        return state, reward, done
+        return self.playerfield.copy(), reward, done
+
+
+    def jit_step(self, action):
+        # step() through the compiled reveal kernel, which reveals the tile
+        # and its zero cascade at once. Same rules, rewards and scores
+        tile = self.minefield.flat[action]
+        revealed = env_kernels.reveal(self.minefield.ravel(), self.playerfield.ravel(),
+                                      self.neighbors, action, 9, self.reveal_queue)
+        self.num_hidden_tiles -= revealed
+        self.note_revealed(self.reveal_queue[:revealed])
+        if tile == -1:
+            done = True
+            self.explosion = True
+            reward = -1
+            score = 0
+        else:
+            done = self.num_hidden_tiles == self.mine_count
+            reward = 1.0 if done else 0.1
+            # A zero scores every tile of its cascade. A won board scores at
+            # least 1, also when a move on it reveals nothing
+            score = revealed if tile == 0 else 1
+            if done:
+                score = max(score, 1)
+        self.score += score
+        self.done = done
+        self.move_num += 1
+        return self.playerfield.copy(), reward, done
+
+
+    def note_revealed(self, tiles):
+        # Updates the tracked tiles and the observation, if kept, for tiles
+        # that were just revealed. Mines have no channel
+        if self.frontier is not None:
+            self.track_revealed(tiles)
+        if self.observation is not None:
+            numbers = self.minefield.flat[tiles]
+            shown = (numbers >= 0) & (numbers < 9)
+            self.observation.flat[tiles[shown]*9 + numbers[shown]] = 1
+
+
+    def note_revealed_tile(self, tile):
+        # note_revealed for a single tile
+        if self.frontier is not None:
+            self.track_revealed_tile(tile)
+        if self.observation is not None:
+            number = int(self.minefield.flat[tile])
+            if 0 <= number < 9:
+                self.observation.flat[tile*9 + number] = 1
+
+
+    def valid_actions(self):
+        # Flat indices of the hidden tiles, with track_frontier
+        return self.hidden.members()
+
+
+    def frontier_actions(self):
+        # Flat indices of the hidden tiles next to a revealed tile, with
+        # track_frontier
+        return self.frontier.members()
+
+
+    def init_tracking(self):
+        # Builds the hidden tiles and the frontier from the playerfield
+        hidden = self.playerfield == 9
+        self.hidden = TileSet(hidden.size, np.flatnonzero(hidden))
+        frontier = dilate(~hidden[None])[0] & hidden
+        self.frontier = TileSet(hidden.size, np.flatnonzero(frontier))
+
+
+    def track_revealed(self, tiles):
+        # Updates the hidden tiles and the frontier after tiles were revealed:
+        # they leave both and their hidden neighbors join the frontier
+        self.hidden.remove(tiles)
+        self.frontier.remove(tiles)
+        neighbors = self.neighbors[tiles].ravel()
+        neighbors = neighbors[neighbors >= 0]
+        self.frontier.add(neighbors[self.playerfield.flat[neighbors] == 9])
+
+
+    def track_revealed_tile(self, tile):
+        # track_revealed for a single tile, without array operations
+        self.hidden.remove_tile(tile)
+        self.frontier.remove_tile(tile)
+        for neighbor in self.neighbors[tile].tolist():
+            if neighbor >= 0 and self.hidden.position[neighbor] >= 0:
+                self.frontier.add_tile(neighbor)
       
 
     def reset(self):
@@ -90,55 +388,105 @@ class Minesweeper:
         self.move_num = 0
         self.explosion = False
         self.done = False
-        self.minefield = np.zeros((self.rowdim,self.coldim), dtype='int')
-        self.playerfield = np.ones((self.rowdim,self.coldim), dtype='int')*9
-        self.generate_field()
-        state = self.play_first_move()
-        return state
+        self.hidden = None
+        self.frontier = None
+        if self.board_bank is not None:
+            self.load_board(*self.board_bank[self.bank_index])
+            self.bank_index = (self.bank_index + 1) % len(self.board_bank)
+        else:
+            self.minefield = np.zeros((self.rowdim,self.coldim), dtype=np.int8)
+            self.playerfield = np.full((self.rowdim,self.coldim), 9, dtype=np.int8)
+            self.num_hidden_tiles = self.rowdim * self.coldim
+            self.generate_field()
+            if self.zero_labels is not None:
+                self.reveal_opening()
+            else:
+                # Compiled and bitboard boards step their first move
+                self.play_first_move()
+        if self.track_frontier:
+            self.init_tracking()
+        if self.observation is not None:
+            one_hot_encode(self.playerfield[None], 9, out=self.observation)
+        # A copy, so the state is not changed by the following steps
+        return self.playerfield.copy()
+
+
+    def load_board(self, minefield, playerfield, score):
+        # Continues a game from a minefield and the player's view of it after
+        # the first move, as stored in a BoardBank, and returns the state
+        self.minefield = minefield.astype(np.int8)
+        self.playerfield = playerfield.astype(np.int8)
+        self.zero_labels = None # Labeled at the first zero cascade
+        self.num_hidden_tiles = np.count_nonzero(self.playerfield == 9)
+        self.score = int(score)
+        self.move_num = len(self.opening_actions)
+        self.done = self.num_hidden_tiles == self.mine_count
+        return self.playerfield
 
         
     def generate_field(self):
         # Generates the minefield using the seeded random number generator.
-        # The while loop randomly places mines in the grid, and then increments
-        # the tile number of all adjacent non-mine tiles
-        num_mines = 0
-        while num_mines < self.mine_count:
-            x_rand = self.np_random.randint(0,self.rowdim-1)        
-            y_rand = self.np_random.randint(0,self.coldim-1)
-            # Reserve a mine-free tile in the center for the first move
-            if (x_rand, y_rand) != (int((self.rowdim/2)-1),int((self.coldim/2)-1)):
-                if self.minefield[x_rand,y_rand] != -1:
-                    self.minefield[x_rand,y_rand] = -1
-                    num_mines += 1
-                    for k in range(-1,2):
-                        for h in range(-1,2):
-                            try:
-                                if self.minefield[x_rand+k, y_rand+h] != -1:
-                                    if x_rand+k > -1 and y_rand+h > -1:
-                                        self.minefield[x_rand+k, y_rand+h] += 1
-                            except IndexError:
-                                pass
+        # All mine positions are drawn at once, uniformly over every tile
+        # except the 3x3 block of the first move, which is kept mine-free.
+        # Non-mine tiles hold the number of adjacent mines
+        if self.jit:
+            draws = self.np_random.random_sample(self.mine_count)
+            env_kernels.place_mines(self.minefield.ravel(), self.neighbors,
+                                    self.mine_candidates, draws, self.mine_count)
+            return
+        self.minefield[:] = generate_minefields(1, self.rowdim, self.coldim, self.mine_count,
+                                                self.np_random, self.opening_actions)[0]
+        # Zero regions and their borders, revealed at once by auto_reveal_tiles
+        self.zero_labels, self.region_tiles, self.region_bounds = zero_regions(self.minefield)
 
 
     def play_first_move(self):
         """
         Lets the environment play the first move 
         """
-        # First move is a 3x3 grid in top left corner
-
-        lst = []
-        x = int(1)
-        y = int(1)
-        action_idx = np.ravel_multi_index((x, y), (self.rowdim, self.coldim))
-        lst.append(self.step(action_idx))
-        for i in range(-1,2):
-            for j in range(-1,2):
-                try:
-                    action_idx = np.ravel_multi_index((x + i, y + j), (self.rowdim, self.coldim))
-                    lst.append(self.step(action_idx))
-                except:
-                    pass
-        return lst[-1][0]
+        # First move is a 3x3 grid in top left corner, stepped tile by tile
+        for action in self.opening_actions:
+            state, reward, done = self.step(action)
+        return state
+
+
+    def reveal_opening(self):
+        """
+        Reveals the first move at once, with the same board, score and move
+        count as play_first_move. Uses the zero regions of generate_field
+        """
+        # Every zero region of the 3x3 grid cascades at the first step into
+        # it, cover holds the step at which a tile is revealed by a cascade
+        num_steps = len(self.opening_actions)
+        regions = self.zero_labels.flat[self.opening_tiles]
+        region_steps = {}
+        for region, step in zip(regions.tolist(), self.opening_first_steps.tolist()):
+            if region >= 0:
+                region_steps[region] = min(step, region_steps.get(region, num_steps))
+        cover = np.full(self.rowdim*self.coldim, num_steps)
+        for region, step in region_steps.items():
+            cascade = self.region_tiles[self.region_bounds[region]:self.region_bounds[region+1]]
+            cover[cascade] = np.minimum(cover[cascade], step)
+        cascaded = cover < num_steps
+        revealed = cascaded.copy()
+        revealed[self.opening_tiles] = True
+        num_hidden_tiles = revealed.size - np.count_nonzero(revealed)
+        if num_hidden_tiles == self.mine_count:
+            # Won during the first move, after which every step scores 1
+            return self.play_first_move()
+        # Steps on non-zero tiles score 1 each, cascades score the tiles they
+        # reveal that no earlier step on a non-zero tile revealed
+        numbers = self.minefield.flat[self.opening_actions]
+        stepped_first = (regions < 0) & (self.opening_first_steps < cover[self.opening_tiles])
+        score = np.count_nonzero(numbers) + np.count_nonzero(cascaded) - \
+            np.count_nonzero(stepped_first & cascaded[self.opening_tiles])
+        revealed = revealed.reshape(self.rowdim, self.coldim)
+        self.playerfield[revealed] = self.minefield[revealed]
+        self.num_hidden_tiles = num_hidden_tiles
+        self.score += int(score)
+        self.move_num += num_steps
+        self.done = False
+        return self.playerfield
 
 
     def seed(self, seed=None):
@@ -148,44 +496,19 @@ class Minesweeper:
     def auto_reveal_tiles(self, action):
         # If the player selects a safe tile that has no adjacent mines (a zero)
         # all adjacent tiles will be revealed, and any zero tiles revealed 
-        # will also have their adjacent tiles revealed in a chain reaction
-        idx1, idx2 = np.unravel_index(action, (self.rowdim, self.coldim))
-        old_zeros = [] # Keep track of already revealed zeros
-        new_zeros = deque([(idx1,idx2)]) # Keep track of newly discovered zeros
-        state = self.playerfield.copy()
-        revealed_tiles = [tuple(x) for x in np.argwhere(state!=9)] # Keep track of indices of revealed tiles
-        score = 0
-        zero_found = True
-        while zero_found:
-            # Iterate through indices of tile and its 8 neighbors
-            for k in range(-1,2):
-                for h in range(-1,2):
-                    idx1 = new_zeros[0][0] + k
-                    idx2 = new_zeros[0][1] + h
-                    if idx1 >= 0 and idx2 >= 0: # Avoid negative indices
-                        try:
-                            if (idx1, idx2) not in revealed_tiles:
-                                # Reveal tile
-                                state[idx1,idx2] = self.minefield[idx1,idx2]
-                                score += 1
-                                # Add revealed tile index to list
-                                revealed_tiles.append((idx1,idx2))
-                                # Check to see if it's also a zero tile
-                                if self.minefield[idx1, idx2] == 0:
-                                    # Make sure we haven't seen this zero before
-                                    if (idx1, idx2) not in old_zeros:
-                                        if (idx1, idx2) not in new_zeros:
-                                            # Add to newly discovered zero list
-                                            new_zeros.append((idx1,idx2))
-                        except IndexError:
-                            pass # Ignore invalid indices at border of minefield
-            # Move indices from new zero list to old zero list
-            old_zeros.append(new_zeros.popleft())
-            if len(new_zeros) == 0:
-                # Terminate loop
-                zero_found = False
-            
-        return state.flatten(), score
+        # will also have their adjacent tiles revealed in a chain reaction.
+        # The zero regions are labeled when the field is generated, so this
+        # only touches the tiles of the chosen tile's region and its border.
+        # Reveals the tiles in place and returns the number newly revealed
+        if self.zero_labels is None:
+            self.zero_labels, self.region_tiles, self.region_bounds = zero_regions(self.minefield)
+        region = self.zero_labels.flat[action]
+        tiles = self.region_tiles[self.region_bounds[region]:self.region_bounds[region+1]]
+        hidden = tiles[self.playerfield.flat[tiles] == 9]
+        self.playerfield.flat[hidden] = self.minefield.flat[hidden]
+        self.num_hidden_tiles -= hidden.size
+        self.note_revealed(hidden)
+        return hidden.size
     
 
     def init_gui(self):
@@ -320,4 +643,276 @@ class Minesweeper:
     
     
     def close(self):
-        pygame.quit()
\ No newline at end of file
+        pygame.quit()
+
+
+
+class VectorMinesweeper:
+    """
+    Plays num_envs Minesweeper games at once. The games are stored as
+    (num_envs, rowdim, coldim) arrays and step() takes one action per game.
+    The rules, rewards and scores are those of Minesweeper, including the
+    first move played at reset. Finished games are reset automatically:
+    their final board, score and explosion flag are kept in final_states,
+    final_scores and final_explosions, while the returned state is the
+    opening of the new game
+    """
+
+    def __init__(self, num_envs, rowdim, coldim, mine_count):
+        self.num_envs = num_envs
+        self.rowdim = rowdim # number of tiles along the row dimension
+        self.coldim = coldim # number of tiles along the column dimension
+        self.mine_count = mine_count
+        self.np_random = np.random.RandomState() # For seeding the environment
+        shape = (num_envs, rowdim, coldim)
+        self.minefield = np.zeros(shape, dtype=np.int8) # The complete game states
+        self.playerfield = np.full(shape, 9, dtype=np.int8) # The states the player sees
+        self.num_hidden_tiles = np.full(num_envs, rowdim*coldim)
+        self.explosion = np.zeros(num_envs, dtype=bool)
+        self.score = np.zeros(num_envs, dtype=np.int64)
+        self.move_num = np.zeros(num_envs, dtype=np.int64)
+        self.final_states = np.full(shape, 9, dtype=np.int8)
+        self.final_scores = np.zeros(num_envs, dtype=np.int64)
+        self.final_explosions = np.zeros(num_envs, dtype=bool)
+        # First move played at reset, its tiles never hold a mine
+        self.opening_actions = opening_actions(rowdim, coldim)
+
+
+    def seed(self, seed=None):
+        self.np_random.seed(seed)
+
+
+    def reset(self):
+        # Starts a new game on every board and returns the states
+        self._reset_boards(np.arange(self.num_envs))
+        return self.playerfield.copy()
+
+
+    def step(self, actions):
+        # Plays one action on every board and returns the new states,
+        # rewards and whether each game has terminated
+        boards = np.arange(self.num_envs)
+        rewards, dones = self._step_boards(boards, np.asarray(actions))
+        finished = np.flatnonzero(dones)
+        if finished.size > 0:
+            self.final_states[finished] = self.playerfield[finished]
+            self.final_scores[finished] = self.score[finished]
+            self.final_explosions[finished] = self.explosion[finished]
+            self._reset_boards(finished)
+        return self.playerfield.copy(), rewards, dones
+
+
+    def _reset_boards(self, boards):
+        # Generates new games on the given boards and plays the first move
+        self.minefield[boards] = generate_minefields(len(boards), self.rowdim, self.coldim,
+                                                     self.mine_count, self.np_random, self.opening_actions)
+        self.playerfield[boards] = 9
+        self.num_hidden_tiles[boards] = self.rowdim * self.coldim
+        self.explosion[boards] = False
+        self.score[boards] = 0
+        self.move_num[boards] = 0
+        for action in self.opening_actions:
+            self._step_boards(boards, np.full(len(boards), action))
+
+
+    def _step_boards(self, boards, actions):
+        # Applies Minesweeper.step to the given boards, one action each
+        rows, cols = np.unravel_index(actions, (self.rowdim, self.coldim))
+        tiles = self.minefield[boards, rows, cols]
+        was_hidden = self.playerfield[boards, rows, cols] == 9
+        self.playerfield[boards, rows, cols] = tiles
+        self.num_hidden_tiles[boards] -= was_hidden
+        mine = tiles == -1
+        won = ~mine & (self.num_hidden_tiles[boards] == self.mine_count)
+        zero = ~mine & ~won & (tiles == 0)
+        # Safe tile revealed: score 1, zero tiles score every tile revealed
+        score = np.where(mine, 0, 1)
+        if zero.any():
+            zero_boards = boards[zero]
+            newly_revealed = self._auto_reveal_tiles(zero_boards, rows[zero], cols[zero], was_hidden[zero])
+            score[zero] = newly_revealed
+            self.num_hidden_tiles[zero_boards] -= newly_revealed - was_hidden[zero]
+            won[zero] = self.num_hidden_tiles[zero_boards] == self.mine_count
+        self.explosion[boards] |= mine
+        rewards = np.where(mine, -1.0, np.where(won, 1.0, 0.1))
+        dones = mine | won
+        self.score[boards] += score
+        self.move_num[boards] += 1
+        return rewards, dones
+
+
+    def _auto_reveal_tiles(self, boards, rows, cols, was_hidden):
+        # Reveals the connected zero regions containing the chosen tiles and
+        # all tiles bordering them, for all given boards at once. Returns the
+        # number of tiles newly revealed per board, counting the chosen tile
+        # if it was hidden before the move
+        zeros = self.minefield[boards] == 0
+        region = np.zeros(zeros.shape, dtype=bool)
+        region[np.arange(len(boards)), rows, cols] = True
+        while True:
+            grown = dilate(region) & zeros
+            grown |= region
+            if np.array_equal(grown, region):
+                break
+            region = grown
+        revealed = dilate(region)
+        playerfield = self.playerfield[boards]
+        newly_revealed = np.count_nonzero(revealed & (playerfield == 9), axis=(1,2)) + was_hidden
+        playerfield[revealed] = self.minefield[boards][revealed]
+        self.playerfield[boards] = playerfield
+        return newly_revealed
+
+
+
+class BitboardMinesweeper(Minesweeper):
+    """
+    Minesweeper with the game kept as bitboards: Python integers with bit
+    row*coldim + col set for every tile of a set, such as the mines or the
+    revealed tiles. Mine placement, neighbor counts, the hidden tile count
+    and the zero cascade are shifts and masks on whole boards. Meant for
+    small boards like 8x8, where every set fits in 64 bits. Same interface
+    and rules as Minesweeper, playerfield and minefield are kept up to date
+    for the agent and the GUI
+    """
+
+    def __init__(self, rowdim, coldim, mine_count, gui=False, board_bank=None):
+        super().__init__(rowdim, coldim, mine_count, gui, board_bank=board_bank)
+        self.size = rowdim * coldim
+        self.full = (1 << self.size) - 1 # Every tile of the board
+        first_col = sum(1 << (k*coldim) for k in range(rowdim))
+        self.not_first_col = self.full & ~first_col
+        self.not_last_col = self.full & ~(first_col << (coldim - 1))
+        self.opening = sum(1 << int(action) for action in set(self.opening_actions))
+        self.mines = 0
+        self.zeros = 0 # Safe tiles without adjacent mines
+        self.revealed = 0
+
+
+    def reset(self):
+        self.revealed = 0
+        return super().reset()
+
+
+    def load_board(self, minefield, playerfield, score):
+        state = super().load_board(minefield, playerfield, score)
+        self.set_mines(self.from_array(self.minefield == -1))
+        self.revealed = self.from_array(self.playerfield != 9)
+        return state
+
+
+    def neighbor_boards(self, board):
+        # The 8 boards holding, at every tile, the bit of one of its neighbors
+        west = (board << 1) & self.not_first_col
+        east = (board >> 1) & self.not_last_col
+        boards = [west, east]
+        for row in (board, west, east):
+            boards.append((row << self.coldim) & self.full)
+            boards.append(row >> self.coldim)
+        return boards
+
+
+    def dilate(self, board):
+        # The tiles of board and all their neighbors
+        rows = board | ((board << 1) & self.not_first_col) | ((board >> 1) & self.not_last_col)
+        return (rows | (rows << self.coldim) | (rows >> self.coldim)) & self.full
+
+
+    def from_array(self, tiles):
+        # Bitboard of the tiles set in a boolean (rowdim, coldim) array
+        bits = np.packbits(tiles.ravel(), bitorder='little')
+        return int.from_bytes(bits.tobytes(), 'little')
+
+
+    def to_array(self, board):
+        # Boolean (rowdim, coldim) array of the tiles set in board
+        data = np.frombuffer(board.to_bytes((self.size + 7) // 8, 'little'), dtype=np.uint8)
+        bits = np.unpackbits(data, count=self.size, bitorder='little')
+        return bits.view(bool).reshape(self.rowdim, self.coldim)
+
+
+    def generate_field(self):
+        # Draws tiles until mine_count distinct tiles outside the first move
+        # hold a mine
+        allowed = self.full & ~self.opening
+        if self.mine_count > allowed.bit_count():
+            raise ValueError('{} mines do not fit on the {} tiles of a {}x{} board outside the opening'
+                             .format(self.mine_count, allowed.bit_count(), self.rowdim, self.coldim))
+        mines = 0
+        for _ in range(self.mine_count):
+            while True:
+                tile = 1 << self.np_random.randint(self.size)
+                if tile & allowed:
+                    break
+            mines |= tile
+            allowed &= ~tile
+        self.set_mines(mines)
+
+
+    def set_mines(self, mines):
+        # Counts the adjacent mines of every tile with a bit-sliced adder:
+        # counts[k] holds bit k of the count of each tile
+        counts = [0, 0, 0, 0]
+        for carry in self.neighbor_boards(mines):
+            for k in range(4):
+                counts[k], carry = counts[k] ^ carry, counts[k] & carry
+                if not carry:
+                    break
+        self.mines = mines
+        self.zeros = self.full & ~(mines | counts[0] | counts[1] | counts[2] | counts[3])
+        minefield = sum(self.to_array(count).astype(int) << k for k, count in enumerate(counts))
+        minefield[self.to_array(mines)] = -1
+        self.minefield[:] = minefield
+
+
+    def step(self, action):
+        # Same as Minesweeper.step, with the tile sets as bitboards
+        tile = 1 << int(action)
+        revealed = self.revealed
+        self.revealed |= tile
+        self.playerfield.flat[action] = self.minefield.flat[action]
+        self.num_hidden_tiles = (self.full & ~self.revealed).bit_count()
+        if tile & self.mines:
+            # Tile was a hidden mine, game over
+            done = True
+            self.explosion = True
+            reward = -1
+            score = 0 # Hitting mine should not subtract points from score
+        elif self.num_hidden_tiles == self.mine_count:
+            # The player has won by revealing all non-mine tiles
+            done = True
+            reward = 1.0
+            score = 1
+        elif tile & self.zeros:
+            # The tile was a zero, run auto-reveal routine
+            self.auto_reveal_tiles(action)
+            score = (self.revealed & ~revealed).bit_count()
+            done = self.num_hidden_tiles == self.mine_count
+            reward = 1.0 if done else 0.1
+        else:
+            # Player has revealed a non-mine tile, but has not won yet
+            done = False
+            reward = 0.1
+            score = 1
+        # Update environment parameters
+        self.score += score
+        self.done = done
+        self.move_num += 1
+        return self.playerfield.copy(), reward, done
+
+
+    def auto_reveal_tiles(self, action):
+        # Grows the region of zeros around the chosen zero one ring per
+        # iteration, then reveals it with its border. Returns the number of
+        # tiles newly revealed
+        region = 1 << int(action)
+        while True:
+            grown = region | (self.dilate(region) & self.zeros)
+            if grown == region:
+                break
+            region = grown
+        new = self.dilate(region) & ~self.revealed
+        self.revealed |= new
+        self.num_hidden_tiles -= new.bit_count()
+        new_tiles = self.to_array(new)
+        self.playerfield[new_tiles] = self.minefield[new_tiles]
+        return new.bit_count()